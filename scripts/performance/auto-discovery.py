@@ -1,5 +1,6 @@
 import argparse
 import os
+import re
 import sys
 import psutil
 import json
@@ -34,6 +35,28 @@ def get_numa_info() -> tuple[dict, int]:
 
   return numa_dict, numa_nodes
 
+def parse_link(vline : str) -> dict:
+  # e.g. "LnkCap: Port #0, Speed 8GT/s, Width x16, ..." or "LnkSta: Speed 8GT/s (ok), Width x8 (downgraded)"
+  speed = re.search(r'Speed ([0-9.]+)GT/s', vline)
+  width = re.search(r'Width x([0-9]+)', vline)
+  return {'speed' : float(speed.group(1)) if speed else None, 'width' : int(width.group(1)) if width else None}
+
+def link_bandwidth(link : dict) -> float:
+  # usable bandwidth in Gb/s, after line encoding: 8b/10b up to 5GT/s, 128b/130b up to 32GT/s, FLIT above
+  if link['speed'] is None or link['width'] is None:
+    return 0.
+  if link['speed'] <= 5:
+    efficiency = 8/10
+  elif link['speed'] <= 32:
+    efficiency = 128/130
+  else:
+    efficiency = 242/256
+  return link['speed'] * link['width'] * efficiency
+
+def link_id(address : str) -> str:
+  # the functions of a multi-function device (e.g. 17:00.0 and 17:00.1, a dual-port NIC) share one physical link
+  return address.rsplit('.', 1)[0]
+
 def run_cmd(cmd : list[str]):
   try:
     return check_output(cmd, stderr = subprocess.STDOUT).decode("utf-8").splitlines()
@@ -45,6 +68,7 @@ def main(args : argparse.Namespace):
   dev_dict = {}
   for dev in args.device:
     dev_dict[dev] = {}
+  link_dict = {}
 
   ##### Check NUMA
   numa_dict, numa_nodes = get_numa_info()
@@ -59,10 +83,15 @@ def main(args : argparse.Namespace):
         if devl[1].find(dev) != -1:
           dev_dict[dev][devl[0]] = devl
           verbose_info = run_cmd(["lspci", "-s", devl[0], "-vvvvv"])
+          link_dict[devl[0]] = {'category' : dev, 'cap' : None, 'sta' : None}
           for vline in verbose_info:
             if vline.find('NUMA') != -1:
               zone = vline.split()[2]
               dev_dict[dev][devl[0]].append(int(zone))
+            if vline.find('LnkCap:') != -1:
+              link_dict[devl[0]]['cap'] = parse_link(vline)
+            if vline.find('LnkSta:') != -1:
+              link_dict[devl[0]]['sta'] = parse_link(vline)
 
     for cat in dev_dict:
       for dev in dev_dict[cat]:
@@ -71,6 +100,22 @@ def main(args : argparse.Namespace):
           numa_dict[str(zone)] = {'devices' : []}
         else:
           numa_dict[str(zone)]['devices'].append((dev, dev_dict[cat][dev][1]))
+        link_dict[dev]['numa'] = zone
+
+  ##### Check PCIe links, bandwidth budget per NUMA node (Gb/s), each physical link counted once
+  counted = set()
+  for dev, link in link_dict.items():
+    link['degraded'] = False
+    if link['cap'] and link['sta']:
+      for key in ['speed', 'width']:
+        if link['sta'][key] is not None and link['cap'][key] is not None and link['sta'][key] < link['cap'][key]:
+          link['degraded'] = True
+    link['bandwidth'] = link_bandwidth(link['sta']) if link['sta'] else 0.
+    link['shared'] = link_id(dev) in counted
+    if 'numa' in link and str(link['numa']) in numa_dict and not link['shared']:
+      counted.add(link_id(dev))
+      budget = numa_dict[str(link['numa'])].setdefault('pcie_bandwidth', {'input' : 0., 'nvme' : 0.})
+      budget['nvme' if link['category'] == 'Non-Volatile' else 'input'] += link['bandwidth']
 
   ##### Check NVMe
   nvme_dict={}
@@ -181,6 +226,37 @@ def main(args : argparse.Namespace):
     print('#### Full NUMA map')
     print(json.dumps(numa_dict, sort_keys=False, indent=4))
 
+  if len(link_dict) > 0:
+    print('#### PCIe links:')
+    for dev, link in link_dict.items():
+      if link['cap'] is None or link['sta'] is None:
+        print('   *', dev, link['category'], ': link speed/width not reported')
+        continue
+      state = '[red]DEGRADED[/red]' if link['degraded'] else 'ok'
+      print('   *', dev, link['category'], f": {link['sta']['speed']}GT/s x{link['sta']['width']} (capable {link['cap']['speed']}GT/s x{link['cap']['width']}),", f"{link['bandwidth']:.1f} Gb/s", state + (' (link shared with another function)' if link['shared'] else ''))
+    for numa in numa_dict:
+      if 'pcie_bandwidth' in numa_dict[numa]:
+        budget = numa_dict[numa]['pcie_bandwidth']
+        print('   * bandwidth node', numa, f": input {budget['input']:.1f} Gb/s, NVMe {budget['nvme']:.1f} Gb/s")
+
+  if args.rates:
+    # expected input rate per application: {"app": {"numa": 0, "rate": 100, "record": true}}, rate in Gb/s
+    with open(args.rates, 'r') as f:
+      rates = json.load(f)
+    print('#### Bandwidth budget:')
+    for numa in numa_dict:
+      apps = {app : r for app, r in rates.items() if str(r['numa']) == numa}
+      if len(apps) == 0:
+        continue
+      budget = numa_dict[numa].get('pcie_bandwidth', {'input' : 0., 'nvme' : 0.})
+      rate = sum(r['rate'] for r in apps.values())
+      rec_rate = sum(r['rate'] for r in apps.values() if r.get('record', False))
+      print('   * node', numa, f": expected input {rate:.1f} Gb/s from {', '.join(apps.keys())} (recorded {rec_rate:.1f} Gb/s)")
+      if rate > budget['input']:
+        print(f"[red]WARNING: node {numa} input devices can only sustain {budget['input']:.1f} Gb/s, {rate:.1f} Gb/s expected[/red]")
+      if rec_rate > budget['nvme']:
+        print(f"[red]WARNING: node {numa} NVMe drives can only sustain {budget['nvme']:.1f} Gb/s, {rec_rate:.1f} Gb/s to record[/red]")
+
   if args.diag:
     print('Should run diagnostics...')
     # are raids mounted
@@ -195,6 +271,7 @@ if __name__ == "__main__":
   parser.add_argument('--device', '-d', action='append', required=False, help='device to try auto-discover')
   parser.add_argument('--diag', action='store_true', required=False, help='do quick system diagnostics')
   parser.add_argument('--verbose', '-v', action='store_true', required=False, help='verbose output')
+  parser.add_argument('--rates', '-r', required=False, help='json file with the expected input rate (Gb/s) and numa node of each application, checked against the PCIe bandwidth')
   parser.set_defaults(device=def_devs)
   parser.set_defaults(diag=False)
   parser.set_defaults(verbose=False)
@@ -0,0 +1,325 @@
+#!/usr/bin/env python
+"""
+Description: Search for the pinning configuration that gives the best benchmark throughput.
+
+Candidate pinnings are generated with create_pinning_minimal.py by varying the number
+of cpus per thread type (--rawproc, --ccp, --recording, --tpproc) and the placement
+strategy (extra generator arguments, e.g. a noise profile). For each candidate a user
+supplied benchmark command is launched with the affinity of the pinned cores, and a
+throughput metric is parsed from its output. The candidates are ranked with successive
+halving: all are run with a small number of repetitions, the best fraction is kept and
+run again with more repetitions, until one is left or the budget is spent.
+
+The benchmark can be any command, e.g. rubberdaq_test_hdf5_overhead or a local stand-in
+script. "{pinning}" in the command is replaced by the path of the candidate pinning
+file, which is also exported as CPUPIN_FILE.
+"""
+import argparse
+import itertools
+import json
+import math
+import os
+import re
+import shlex
+import signal
+import statistics
+import subprocess
+import sys
+import tempfile
+
+from rich import print
+from rich.table import Table
+
+from create_pinning_minimal import pinned_cpus, str_to_cpu_list
+
+GENERATOR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "create_pinning_minimal.py")
+PINNING_FILE = "cpupin-all-running.json"
+
+
+class Candidate:
+    """
+    A pinning configuration under test.
+
+    Attributes
+    ----------
+    params : dict
+        Number of cpus per thread type passed to the generator.
+    strategy : str
+        Name of the placement strategy.
+    strategy_args : list[str]
+        Extra generator arguments of the placement strategy.
+    pinning : str
+        Path of the generated pinning file, None if generation failed.
+    results : list[float]
+        Metric value of each benchmark run.
+    errors : list[str]
+        Errors from the generator or benchmark.
+    """
+    def __init__(self, params : dict, strategy : str, strategy_args : list[str]) -> None:
+        self.params = params
+        self.strategy = strategy
+        self.strategy_args = strategy_args
+        self.pinning = None
+        self.results = []
+        self.errors = []
+        pass
+
+
+    @property
+    def name(self) -> str:
+        """ Short description of the candidate, for printing. """
+        return " ".join([f"{k}={v}" for k, v in self.params.items()] + [f"strategy={self.strategy}"])
+
+
+    @property
+    def score(self) -> float:
+        """ Mean metric over the runs, -inf if there are none so failed candidates rank last. """
+        return statistics.mean(self.results) if self.results else -math.inf
+
+
+    def score_of(self, n_runs : int) -> float:
+        """ Mean metric over the first n_runs runs, so that candidates with different numbers of runs can be compared. """
+        return statistics.mean(self.results[:n_runs]) if self.results else -math.inf
+
+
+def parse_sweep(sweeps : list[str]) -> dict[str, list[int]]:
+    """ Parse the --sweep arguments.
+
+    Args:
+        sweeps (list[str]): Arguments like "rawproc=8,12,16".
+
+    Returns:
+        dict[str, list[int]]: Values to try per thread type.
+    """
+    values = {}
+    for s in sweeps:
+        key, vals = s.split("=", 1)
+        values[key] = str_to_cpu_list(vals)
+    return values
+
+
+def make_candidates(sweep : dict[str, list[int]], strategies : dict[str, list[str]]) -> list[Candidate]:
+    """ Make one candidate per combination of swept values and placement strategy.
+
+    Args:
+        sweep (dict[str, list[int]]): Values to try per thread type.
+        strategies (dict[str, list[str]]): Extra generator arguments per strategy.
+
+    Returns:
+        list[Candidate]: Candidates.
+    """
+    keys = list(sweep.keys())
+    candidates = []
+    for combination in itertools.product(*[sweep[k] for k in keys]):
+        for strategy, strategy_args in strategies.items():
+            candidates.append(Candidate(dict(zip(keys, combination)), strategy, strategy_args))
+    return candidates
+
+
+def generate(candidate : Candidate, generator_args : list[str], workdir : str):
+    """ Run the pinning generator for a candidate, in its own directory.
+
+    Args:
+        candidate (Candidate): Candidate to generate the pinning for.
+        generator_args (list[str]): Generator arguments common to all candidates.
+        workdir (str): Directory the generator writes the pinning files to.
+    """
+    cmd = [sys.executable, GENERATOR] + generator_args + candidate.strategy_args
+    for k, v in candidate.params.items():
+        cmd += [f"--{k}", str(v)]
+
+    out = subprocess.run(cmd, cwd = workdir, capture_output = True, text = True)
+    pinning = os.path.join(workdir, PINNING_FILE)
+    if out.returncode != 0 or not os.path.exists(pinning):
+        candidate.errors.append(f"generator failed: {out.stderr.strip().splitlines()[-1] if out.stderr.strip() else out.returncode}")
+    else:
+        candidate.pinning = pinning
+
+
+def benchmark_cpus(pinning : str, app : str = None) -> set[int]:
+    """ CPUs the benchmark is allowed to run on.
+
+    Args:
+        pinning (str): Pinning file.
+        app (str, optional): Only use the cpus of this daq_application. Defaults to None (all pinned cpus).
+
+    Returns:
+        set[int]: Pinned cpus that exist on this machine.
+    """
+    with open(pinning, "r") as f:
+        config = json.load(f)
+    if app is not None:
+        config = {"daq_application" : {app : config["daq_application"][app]}}
+    return pinned_cpus(config) & os.sched_getaffinity(0)
+
+
+def run_benchmark(command : str, pinning : str, cpus : set[int], metric : re.Pattern, agg : str, timeout : float) -> float:
+    """ Launch the benchmark under the affinity of the pinned cpus and parse the metric from its output.
+
+    Args:
+        command (str): Benchmark command, "{pinning}" is replaced by the pinning file path.
+        pinning (str): Pinning file.
+        cpus (set[int]): CPUs to run the benchmark on.
+        metric (re.Pattern): Regular expression, the first group is the metric value.
+        agg (str): How to combine several metric values in the output (mean, max, last).
+        timeout (float): Seconds after which the benchmark and its children are stopped, the output so far is used.
+
+    Raises:
+        Exception: No metric value was found in the output.
+
+    Returns:
+        float: Metric value.
+    """
+    cmd = shlex.split(command.replace("{pinning}", pinning))
+    env = dict(os.environ, CPUPIN_FILE = pinning)
+    # own process group, so that children keeping the output open are stopped too
+    proc = subprocess.Popen(cmd, stdout = subprocess.PIPE, stderr = subprocess.STDOUT, text = True, env = env, start_new_session = True, preexec_fn = lambda : os.sched_setaffinity(0, cpus))
+    try:
+        output, _ = proc.communicate(timeout = timeout)
+    except subprocess.TimeoutExpired:
+        os.killpg(proc.pid, signal.SIGKILL)
+        try:
+            output, _ = proc.communicate(timeout = 5)
+        except subprocess.TimeoutExpired as e: # a child left the process group and still holds the output
+            output = e.output.decode(errors = "replace") if isinstance(e.output, bytes) else (e.output or "")
+            proc.stdout.close()
+            proc.wait()
+
+    values = [float(m.group(1)) for m in metric.finditer(output)]
+    if len(values) == 0:
+        raise Exception(f"no metric found in the output of {cmd[0]} (exit code {proc.returncode})")
+    if agg == "max":
+        return max(values)
+    elif agg == "last":
+        return values[-1]
+    else:
+        return statistics.mean(values)
+
+
+def successive_halving(candidates : list[Candidate], evaluate : callable, min_runs : int, eta : int, budget : int) -> tuple[int, list[Candidate], int]:
+    """ Successive halving search: run all candidates, keep the best 1/eta, run them with eta times more repetitions, ...
+
+    Args:
+        candidates (list[Candidate]): Candidates to rank.
+        evaluate (callable): Runs the benchmark once for a candidate, appending to its results.
+        min_runs (int): Benchmark runs per candidate in the first round.
+        eta (int): Reduction factor between rounds.
+        budget (int): Maximum total number of benchmark runs.
+
+    Returns:
+        tuple[int, list[Candidate], int]: Number of benchmark runs used, the candidates that completed the highest round
+        and the number of runs to compare them on (if the budget ran out during a round, the runs of the previous round).
+    """
+    alive = [c for c in candidates if c.pinning is not None]
+    runs = min_runs
+    used = 0
+    n_round = 0
+    while len(alive) > 0:
+        print(f"round {n_round}: {len(alive)} candidates, {runs} runs each")
+        for c in alive:
+            while len(c.results) + len(c.errors) < runs:
+                if used >= budget:
+                    print("[yellow]benchmark budget exhausted[/yellow]")
+                    if n_round > 0: # compare the candidates of this round on the runs of the previous, completed, round
+                        return used, [c for c in alive if len(c.results) > 0], runs // eta
+                    finished = [c for c in alive if (len(c.results) + len(c.errors) >= runs) and (len(c.results) > 0)]
+                    finalists = finished if finished else [c for c in alive if len(c.results) > 0]
+                    return used, finalists, min([len(c.results) for c in finalists], default = 0)
+                evaluate(c)
+                used += 1
+        alive = [c for c in alive if len(c.results) > 0]
+        if len(alive) <= 1:
+            break
+        alive = sorted(alive, key = lambda c : c.score, reverse = True)[:max(1, len(alive) // eta)]
+        runs *= eta
+        n_round += 1
+    return used, alive, min([len(c.results) for c in alive], default = 0)
+
+
+def print_results(candidates : list[Candidate], unit : str):
+    """ Print the results table, candidates that got further in the search first. """
+    table = Table(title = "pinning autotuning results")
+    for col in ["rank", "candidate", "runs", f"mean {unit}", f"stdev {unit}", "errors"]:
+        table.add_column(col)
+    ranked = sorted(candidates, key = lambda c : (len(c.results), c.score), reverse = True)
+    for i, c in enumerate(ranked):
+        std = statistics.stdev(c.results) if len(c.results) > 1 else 0
+        mean = f"{c.score:.3f}" if c.results else "-"
+        table.add_row(str(i), c.name, str(len(c.results)), mean, f"{std:.3f}", str(len(c.errors)))
+    print(table)
+
+
+def main(args : argparse.Namespace):
+    sweep = parse_sweep(args.sweep) if args.sweep else {"rawproc" : [16]}
+    strategies = {"default" : []}
+    for s in args.strategy:
+        name, extra = s.split("=", 1)
+        strategies[name] = shlex.split(extra)
+    if args.noise_profile:
+        strategies["quiet"] = ["--noise_profile", os.path.abspath(args.noise_profile)]
+
+    candidates = make_candidates(sweep, strategies)
+    print(f"{len(candidates)} candidate pinnings")
+
+    metric = re.compile(args.metric)
+    workdir = tempfile.mkdtemp(prefix = "autotune-") if args.workdir is None else args.workdir
+
+    for i, c in enumerate(candidates):
+        cdir = os.path.join(workdir, f"candidate-{i}")
+        os.makedirs(cdir, exist_ok = True)
+        generate(c, shlex.split(args.generator_args), cdir)
+        if c.errors:
+            print(f"[red]{c.name}: {c.errors[-1]}[/red]")
+
+    def evaluate(c : Candidate):
+        try:
+            cpus = benchmark_cpus(c.pinning, args.app)
+            if len(cpus) == 0:
+                raise Exception("none of the pinned cpus exist on this machine")
+            c.results.append(run_benchmark(args.benchmark, c.pinning, cpus, metric, args.agg, args.timeout))
+            print(f"  -> {c.name}: {c.results[-1]:.3f} {args.unit}")
+        except Exception as err:
+            c.errors.append(str(err))
+            print(f"[red]  -> {c.name}: {err}[/red]")
+
+    used, finalists, n_runs = successive_halving(candidates, evaluate, args.min_runs, args.eta, args.budget)
+    print(f"{used} benchmark runs, candidate pinnings are in {workdir}")
+    print_results(candidates, args.unit)
+
+    if len(finalists) == 0:
+        print("[red]no candidate produced a metric[/red]")
+        return False
+    best = max(finalists, key = lambda c : c.score_of(n_runs))
+    print(f"best configuration: {best.name} ({best.score_of(n_runs):.3f} {args.unit} over {n_runs} runs), pinning: {best.pinning}")
+
+    if args.output:
+        summary = {
+            "best" : {"params" : best.params, "strategy" : best.strategy, "score" : best.score_of(n_runs), "runs" : n_runs, "pinning" : best.pinning},
+            "results" : [{"params" : c.params, "strategy" : c.strategy, "pinning" : c.pinning, "results" : c.results, "errors" : c.errors} for c in candidates],
+        }
+        with open(args.output, "w") as f:
+            json.dump(summary, f, indent = 4)
+        print(f"results have been written to {args.output}")
+    return True
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser("Autotune the pinning configuration against a benchmark command.")
+    parser.add_argument("-b", "--benchmark", type = str, required = True, help = "benchmark command, {pinning} is replaced by the candidate pinning file.")
+    parser.add_argument("-g", "--generator_args", type = str, default = "", help = "arguments passed to create_pinning_minimal.py for every candidate e.g. \"-r np04-srv-031 -n 2\".")
+    parser.add_argument("--sweep", action = "append", help = "thread type and cpu counts to try, e.g. rawproc=8,12,16 (repeat for rawproc, ccp, recording, tpproc).")
+    parser.add_argument("--strategy", action = "append", default = [], help = "named placement strategy as extra generator arguments, e.g. quiet=\"--noise_profile noise.json\".")
+    parser.add_argument("--noise_profile", type = str, help = "shortcut for a \"quiet\" strategy using this noise profile.")
+    parser.add_argument("--app", type = str, help = "run the benchmark on the cpus of this daq_application only, defaults to all pinned cpus.")
+    parser.add_argument("-m", "--metric", type = str, default = r"Throughput:\s*([0-9.eE+-]+)", help = "regular expression for the throughput metric, the first group is the value.")
+    parser.add_argument("--agg", choices = ["mean", "max", "last"], default = "mean", help = "how to combine several metric values printed by one run.")
+    parser.add_argument("--unit", type = str, default = "MiB/s", help = "unit of the metric, for printing.")
+    parser.add_argument("--timeout", type = float, default = 60, help = "seconds after which a benchmark run is stopped, the output so far is used.")
+    parser.add_argument("--min_runs", type = int, default = 1, help = "benchmark runs per candidate in the first round.")
+    parser.add_argument("--eta", type = int, default = 2, help = "successive halving reduction factor.")
+    parser.add_argument("--budget", type = int, default = 100, help = "maximum total number of benchmark runs.")
+    parser.add_argument("--workdir", type = str, help = "directory for the candidate pinning files, defaults to a new temporary directory.")
+    parser.add_argument("-o", "--output", type = str, help = "json file to write the results table to.")
+
+    args = parser.parse_args()
+    sys.exit(0 if main(args) else 1)
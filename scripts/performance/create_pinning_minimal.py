@@ -23,6 +23,10 @@ from socket import gethostname
 
 from rich import print
 
+# thread types of a readout application, as they appear in the thread names
+THREAD_ROLES = ["rte-worker", "tpproc", "rawproc", "cleanup", "consumer", "periodic", "recording"]
+
+
 class CPUList:
     """
     A class to represent a CPU list. CPUs can be retireved from the list,
@@ -35,6 +39,8 @@ class CPUList:
         Flat list of available CPUs.
     cpu_list_regions : list[list[list[int]]]
         List of available CPUs split into numa and if applicable, regions.
+    noisy : set[int]
+        CPUs flagged as noisy by the noise profiler, avoided when a quiet CPU is requested.
 
     Methods
     -------
@@ -46,10 +52,13 @@ class CPUList:
         Loop over the CPU list and return a list of CPUs using "for each", and remove them from the available CPUs lists.
     first_available:
         Return the first CPU (number at index 0) and remove this from the available CPUs lists.
+    last:
+        Return the last available CPUs of the list, and remove them from the available CPUs lists.
     """
-    def __init__(self, cpu_list : list[int], cpu_list_regions : list[list[list[int]]]) -> None:
+    def __init__(self, cpu_list : list[int], cpu_list_regions : list[list[list[int]]], noisy : set[int] = None) -> None:
         self.cpu_list = cpu_list
         self.cpu_list_regions = cpu_list_regions
+        self.noisy = set(noisy) if noisy else set()
         pass
 
 
@@ -60,7 +69,6 @@ class CPUList:
             c (int): CPU number.
 
         Raises:
-            Exception: Available CPU list is empty.
             Exception: CPU number was not found.
 
         Returns:
@@ -69,8 +77,8 @@ class CPUList:
         if c in self.cpu_list:
             self.cpu_list.remove(c)
             for n in self.cpu_list_regions: # loop over numa
-                if len(n) == 0:
-                    raise Exception("no more free cpus available!")
+                if len(n) == 0: # nothing left on this numa, or the numa is not part of this session
+                    continue
                 if type(n[0]) is list: # there should never be a mix of ints and lists in the cpu list, so this is fine.
                     for h in n: # loop over region
                         if c in h: h.remove(c)
@@ -99,37 +107,79 @@ class CPUList:
             return [self[i] for i in list(self.cpu_list_regions[numa][region]) if (i >= _min) and (i < _max)]
 
 
-    def alt_range(self, num : int, numa : int, region : int = None) -> list[int]:
+    def quiet_order(self, available : list[int]) -> list[int]:
+        """ Order a list of available CPUs so that noisy CPUs come last.
+
+        Args:
+            available (list[int]): Available CPUs.
+
+        Returns:
+            list[int]: CPUs not flagged as noisy, followed by the noisy ones.
+        """
+        return [c for c in available if c not in self.noisy] + [c for c in available if c in self.noisy]
+
+
+    def alt_range(self, num : int, numa : int, region : int = None, quiet : bool = False) -> list[int]:
         """ Loop over the CPU list and return a list of CPUs using "for each", and remove them from the available CPUs lists.
 
         Args:
             num (int): Number of CPUs to return
             numa (int): Numa to loop over
             region (int, optional): Region to loop over. Defaults to None.
+            quiet (bool, optional): Skip noisy CPUs while quiet ones are left. Defaults to False.
 
         Returns:
             list[int]: List of selected CPUs.
         """
         if region is None:
-            return [self[i] for i in list(self.cpu_list_regions[numa][:num])]
+            available = list(self.cpu_list_regions[numa])
         else:
-            return [self[i] for i in list(self.cpu_list_regions[numa][region][:num])]
+            available = list(self.cpu_list_regions[numa][region])
+        if quiet:
+            available = sorted(self.quiet_order(available)[:num])
+        return [self[i] for i in available[:num]]
 
 
-    def first_available(self, numa : int, region : int = None) -> int:
+    def first_available(self, numa : int, region : int = None, quiet : bool = False) -> int:
         """ Return the first CPU (number at index 0) and remove this from the available CPUs lists.
 
         Args:
             numa (int): Numa to select from
             region (int, optional): Region to select from. Defaults to None.
+            quiet (bool, optional): Return the first CPU not flagged as noisy, if there is one. Defaults to False.
 
         Returns:
             int: first available CPU
         """
         if region is not None:
-            return self.cpu_list_regions[numa][region][0]
+            available = self.cpu_list_regions[numa][region]
         else:
-            return self.cpu_list_regions[numa][0]
+            available = self.cpu_list_regions[numa]
+        if quiet:
+            return self.quiet_order(available)[0]
+        return available[0]
+
+
+    def last(self, num : int, numa : int, region : int = None) -> list[int]:
+        """ Return the last available CPUs of the list, and remove them from the available CPUs lists.
+
+        The CPUs are taken by position, CPU numbers of a numa node need not be consecutive (e.g. 0, 2, 4, ...).
+
+        Args:
+            num (int): Number of CPUs to return
+            numa (int): Numa to select from
+            region (int, optional): Region to select from. Defaults to None.
+
+        Returns:
+            list[int]: List of selected CPUs.
+        """
+        if num <= 0:
+            return []
+        if region is None:
+            available = list(self.cpu_list_regions[numa])
+        else:
+            available = list(self.cpu_list_regions[numa][region])
+        return [self[i] for i in available[-num:]]
 
 
 def run_command(host : str, cmd : str) -> subprocess.CompletedProcess:
@@ -203,6 +253,56 @@ def get_numa_info(host : str) -> tuple[dict, int]:
     return numa_dict, numa_nodes
 
 
+def load_noisy_cores(path : str, threshold : float = None) -> set[int]:
+    """ Read a noise profile written by noise_profile.py and select the noisy CPUs.
+
+    Args:
+        path (str): Noise profile json file.
+        threshold (float, optional): Noise score above which a CPU is noisy. Defaults to twice the median score.
+
+    Returns:
+        set[int]: Noisy CPUs.
+    """
+    with open(path, "r") as f:
+        profile = json.load(f)
+
+    scores = {int(c) : v["score"] for c, v in profile["cores"].items()}
+    if len(scores) == 0:
+        return set()
+    if threshold is None:
+        ordered = sorted(scores.values())
+        threshold = 2 * ordered[len(ordered) // 2]
+    return {c for c, s in scores.items() if s > threshold}
+
+
+def check_smt_neighbours(pinning : dict, siblings : dict[int, int], compatible : dict[str, list[str]]) -> list[str]:
+    """ Check that thread types placed on SMT siblings are allowed to share a physical core.
+
+    Args:
+        pinning (dict): Pinning configuration.
+        siblings (dict[int, int]): SMT sibling of each CPU.
+        compatible (dict[str, list[str]]): Thread types each thread type may be an SMT neighbour of, from smt_interference.py.
+
+    Returns:
+        list[str]: Incompatible SMT neighbours.
+    """
+    cpu_roles = {}
+    for roles in pinned_roles(pinning).values():
+        for role, role_cpus in roles.items():
+            if role == "parent": continue # parent threads are shared and mostly idle
+            for c in role_cpus:
+                cpu_roles.setdefault(c, set()).add(role)
+
+    problems = []
+    for c, s in siblings.items():
+        if (c > s) or (c not in cpu_roles) or (s not in cpu_roles): continue
+        for r1 in sorted(cpu_roles[c]):
+            for r2 in sorted(cpu_roles[s]):
+                if (r1 in compatible) and (r2 in compatible) and (r2 not in compatible[r1]):
+                    problems.append(f"{r1} on cpu {c} and {r2} on cpu {s} should not share a physical core")
+    return problems
+
+
 def cpu_list_to_str(cpus : list[int]) -> str:
     """ Convert a list of CPUs to a string format for the json file.
 
@@ -216,6 +316,82 @@ def cpu_list_to_str(cpus : list[int]) -> str:
     return ",".join(str(c) for c in cpus)
 
 
+def str_to_cpu_list(cpus : str) -> list[int]:
+    """ Convert a CPU list string (e.g. "1,2,5-7") to a list of CPUs.
+
+    Args:
+        cpus (str): CPU list string
+
+    Returns:
+        list[int]: List of CPUs
+    """
+    cpu_list = []
+    for item in cpus.split(","):
+        item = item.strip()
+        if not item:
+            continue
+        if "-" in item:
+            low, high = item.split("-")
+            cpu_list.extend(range(int(low), int(high) + 1))
+        else:
+            cpu_list.append(int(item))
+    return cpu_list
+
+
+def thread_role(thread : str) -> str:
+    """ Thread type of a thread name in the pinning configuration e.g. "rawproc-0-1.." is a rawproc thread.
+
+    Args:
+        thread (str): Thread name.
+
+    Returns:
+        str: Thread type, or the thread name if it is not a known type.
+    """
+    for role in THREAD_ROLES:
+        if role in thread:
+            return role
+    return thread
+
+
+def pinned_roles(pinning : dict) -> dict[str, dict[str, set[int]]]:
+    """ CPUs pinned to each thread type, per daq application.
+
+    Args:
+        pinning (dict): Pinning configuration.
+
+    Returns:
+        dict[str, dict[str, set[int]]]: CPUs per thread type ("parent" for the parent thread) per daq application.
+    """
+    roles = {}
+    for name, app in pinning["daq_application"].items():
+        roles[name] = {}
+        if app.get("parent"):
+            roles[name]["parent"] = set(str_to_cpu_list(app["parent"]))
+        for t, cpu_str in app.get("threads", {}).items():
+            if cpu_str:
+                roles[name].setdefault(thread_role(t), set()).update(str_to_cpu_list(cpu_str))
+    return roles
+
+
+def pinned_cpus(pinning : dict) -> set[int]:
+    """ Collect every CPU referenced by a pinning configuration, parent and threads.
+
+    Args:
+        pinning (dict): Pinning configuration.
+
+    Returns:
+        set[int]: Pinned CPUs.
+    """
+    cpus = set()
+    for app in pinning["daq_application"].values():
+        if app.get("parent"):
+            cpus.update(str_to_cpu_list(app["parent"]))
+        for cpu_str in app.get("threads", {}).values():
+            if cpu_str:
+                cpus.update(str_to_cpu_list(cpu_str))
+    return cpus
+
+
 def assign_cpus_tpproc(n_regions, cpus, numa, n_cpus):
     #! n_regions should be known from cpus
     if n_regions == 1:
@@ -232,10 +408,11 @@ def assign_cpus_tpproc(n_regions, cpus, numa, n_cpus):
 
 
 def assign_cpus_rawproc(n_regions, cpus, numa, n_cpus):
+    # rawproc is latency critical, so keep it off noisy cores where possible
     if n_regions == 1:
-        cores = cpus.alt_range(n_cpus, numa)
+        cores = cpus.alt_range(n_cpus, numa, quiet = True)
     else:
-        cores = cpus.alt_range(n_cpus//2, numa, 0) + cpus.alt_range(n_cpus//2, numa, 1)
+        cores = cpus.alt_range(n_cpus//2, numa, 0, quiet = True) + cpus.alt_range(n_cpus//2, numa, 1, quiet = True)
     return cores
 
 
@@ -249,7 +426,7 @@ def assign_cpus_ccp(n_regions, cpus, numa, n_cpus):
 
 def assign_cpus_recording(n_regions, cpus, numa, n_cpus):
     if n_regions == 1:
-        cores = cpus.range(cpus.cpu_list_regions[numa][-1] - (n_cpus - 1), cpus.cpu_list_regions[numa][-1] + 1, numa)
+        cores = cpus.last(n_cpus, numa)
     else:
         n_cpus = n_cpus // n_regions
         remainder = n_cpus % n_regions
@@ -259,11 +436,11 @@ def assign_cpus_recording(n_regions, cpus, numa, n_cpus):
                 n = n_cpus + remainder
             else:
                 n = n_cpus
-            cores.extend(cpus.range(cpus.cpu_list_regions[numa][i][-1] - (n - 1), cpus.cpu_list_regions[numa][i][-1] + 1, numa, i))
+            cores.extend(cpus.last(n, numa, i))
     return cores
 
 
-def make_threads(pinning : dict, numa : int, name : int, func : callable, kwargs : dict = None, counter_offset : int = 0):
+def make_threads(pinning : dict, numa : int, name : int, func : callable, kwargs : dict = None, counter_offset : int = 0, app_numa : dict[str, int] = None):
     """ make entries for a specified thread type into the pinning configuration.
 
     Args:
@@ -273,10 +450,11 @@ def make_threads(pinning : dict, numa : int, name : int, func : callable, kwargs
         func (callable): Function to call that makes and adds the cpu list to the configuration.
         kwargs (dict, optional): Arguments to pass to func. Defaults to None.
         counter_offset (int, optional): Offset to the application counter. Defaults to 0.
+        app_numa (dict[str, int], optional): Numa of each daq application, if None it is taken from the application name. Defaults to None.
     """
     counter = 0 + counter_offset # application counter, useful when assigning names to certain threads
     for n in pinning["daq_application"]:
-        if numa == int(n.split(name)[-1][0]):
+        if numa == (app_numa[n] if app_numa is not None else int(n.split(name)[-1][0])):
             counter += 1
             func(pinning, n, counter, **kwargs)
     return
@@ -310,14 +488,14 @@ def make_rte(pinning : dict, name : str, counter : int, cpus : CPUList, numa : i
     """
     for i in range(n_threads):
         if n_regions == 1:
-            c = cpus.first_available(numa)
+            c = cpus.first_available(numa, quiet = True)
             pinning["daq_application"][name]["threads"][f"rte-worker-{c}"] = str(cpus[c])
         else:
             if i >= (n_threads//2):
-                c = cpus.first_available(numa, 1)
+                c = cpus.first_available(numa, 1, quiet = True)
                 pinning["daq_application"][name]["threads"][f"rte-worker-{c}"] = str(cpus[c])
             else:
-                c = cpus.first_available(numa, 0)
+                c = cpus.first_available(numa, 0, quiet = True)
                 pinning["daq_application"][name]["threads"][f"rte-worker-{c}"] = str(cpus[c])
     return
 
@@ -342,6 +520,25 @@ def make_parent(pinning : dict, name : str, counter : int, cpus : CPUList, numa
     return
 
 
+def complete_parent(pinning : dict, name : str, counter : int, noisy : set[int]):
+    """ Make the parent thread cover the cpus given to the rawproc, cleanup, consumer and periodic threads, which are no
+    longer the first available ones when noisy cpus are avoided, and keep it off the noisy cpus these threads do not use.
+
+    Args:
+        pinning (dict): Pinning configuration.
+        name (str): Name of the daq application.
+        counter (int): Current application number.
+        noisy (set[int]): Noisy CPUs.
+    """
+    used = set()
+    for t, cpu_str in pinning["daq_application"][name]["threads"].items():
+        if thread_role(t) in ["rawproc", "cleanup", "consumer", "periodic"]:
+            used.update(str_to_cpu_list(cpu_str))
+    parents = (set(str_to_cpu_list(pinning["daq_application"][name]["parent"])) - noisy) | used
+    pinning["daq_application"][name]["parent"] = cpu_list_to_str(sorted(parents))
+    return
+
+
 def make_rawprocs(pinning : dict, name : str, counter : int, cpus : CPUList, numa : int, n_regions : int, n_cpus : int):
     """ Assign the raw processor threads in the pinning configuration.
 
@@ -390,7 +587,7 @@ def make_recording(pinning : dict, name : str, counter : int, nums : list[int]):
     return
 
 
-def create_threads_numa(pinning : dict, cpus : CPUList, numa : int, name : str, thread_nums : dict[int], n_regions : int, numa_apps : list[int], max_cpus : dict[int]):
+def create_threads_numa(pinning : dict, cpus : CPUList, numa : int, name : str, thread_nums : dict[int], n_regions : int, numa_apps : list[int], max_cpus : dict[int], app_numa : dict[str, int] = None):
     """ Create threads for the pinning file for a single numa.
 
     Args:
@@ -402,6 +599,7 @@ def create_threads_numa(pinning : dict, cpus : CPUList, numa : int, name : str,
         n_regions (int): Number of regions in the numa (a cpu with hypercores would have n_regions = 1).
         numa_apps (list[int]): Number of each daq_application for the numa.
         max_cpus (dict[int]): Number of cpus to assign to each thread type.
+        app_numa (dict[str, int], optional): Numa of each daq application, if None it is taken from the application name. Defaults to None.
 
     RULES:
     
@@ -439,31 +637,55 @@ def create_threads_numa(pinning : dict, cpus : CPUList, numa : int, name : str,
     # tp procs
     tp_procs_numa = assign_cpus_tpproc(n_regions, cpus, numa, max_cpus["tpproc"])
 
-    make_threads(pinning, numa, name, make_tpproc, {"nums" : tp_procs_numa}, counter_offset = numa_apps[numa - 1] if numa > 0 else 0)
+    make_threads(pinning, numa, name, make_tpproc, {"nums" : tp_procs_numa}, counter_offset = numa_apps[numa - 1] if numa > 0 else 0, app_numa = app_numa)
 
     # rtes
-    make_threads(pinning, numa, name, make_rte, {"numa" : numa, "cpus" : cpus, "n_threads" : thread_nums["rte"], "n_regions" : n_regions, "n_cpus" : max_cpus["rte"]})
+    make_threads(pinning, numa, name, make_rte, {"numa" : numa, "cpus" : cpus, "n_threads" : thread_nums["rte"], "n_regions" : n_regions, "n_cpus" : max_cpus["rte"]}, app_numa = app_numa)
 
     # parent threads
-    make_threads(pinning, numa, name, make_parent, {"numa" : numa, "cpus" : cpus, "n_regions" : n_regions, "n_cpus" : max_cpus["rawproc"] + max_cpus["ccp"]})
+    make_threads(pinning, numa, name, make_parent, {"numa" : numa, "cpus" : cpus, "n_regions" : n_regions, "n_cpus" : max_cpus["rawproc"] + max_cpus["ccp"]}, app_numa = app_numa)
 
     # rawprocs
-    make_threads(pinning, numa, name, make_rawprocs, {"numa" : numa, "cpus" : cpus, "n_regions" : n_regions, "n_cpus" : max_cpus["rawproc"]}, numa_apps[numa - 1] if numa > 0 else 0)
+    make_threads(pinning, numa, name, make_rawprocs, {"numa" : numa, "cpus" : cpus, "n_regions" : n_regions, "n_cpus" : max_cpus["rawproc"]}, numa_apps[numa - 1] if numa > 0 else 0, app_numa)
 
     # cleanup, consumer, periodic
-    make_threads(pinning, numa, name, make_ccp, {"numa" : numa, "cpus" : cpus, "n_regions" : n_regions, "n_cpus" : max_cpus["ccp"]}, numa_apps[numa - 1] if numa > 0 else 0)
+    make_threads(pinning, numa, name, make_ccp, {"numa" : numa, "cpus" : cpus, "n_regions" : n_regions, "n_cpus" : max_cpus["ccp"]}, numa_apps[numa - 1] if numa > 0 else 0, app_numa)
+
+    # parent threads cover the rawproc and ccp cpus actually assigned
+    make_threads(pinning, numa, name, complete_parent, {"noisy" : cpus.noisy}, app_numa = app_numa)
 
     # recording #! this appears to have higher priority than ccp threads
-    make_threads(pinning, numa, name, make_recording, {"nums" : assign_cpus_recording(n_regions, cpus, numa, max_cpus["recording"])}, numa_apps[numa - 1] if numa > 0 else 0)
+    make_threads(pinning, numa, name, make_recording, {"nums" : assign_cpus_recording(n_regions, cpus, numa, max_cpus["recording"])}, numa_apps[numa - 1] if numa > 0 else 0, app_numa)
     return
 
 
-def fill_pinning(pinning : dict, cpus : CPUList, max_cpus : dict[int], n_regions : int):
+def numa_from_name(name : str) -> int:
+    """ Numa of a daq application from the end of its name (e.g. ...eth0).
+
+    Args:
+        name (str): Name of the daq application.
+
+    Returns:
+        int: Numa node.
+    """
+    if not name[-2:].isalpha():
+        return int(name[-1])
+    else:
+        return int(name[-2])
+
+
+def fill_pinning(pinning : dict, cpus : CPUList, max_cpus : dict[int], n_regions : int, app_numa : dict[str, int] = None):
+    # the rte-worker cpus are fixed by the template, take them before the other threads are assigned
     for apps in pinning["daq_application"]:
-        if not apps[-2:].isalpha():
-            numa = int(apps[-1])
-        else:
-            numa = int(apps[-2])
+        for t in pinning["daq_application"][apps]["threads"]:
+            if "rte-worker" in t:
+                c = int(t.split("-")[-1])
+                if c in cpus.noisy:
+                    print(f"[yellow]WARNING: {t} of {apps} is pinned to noisy cpu {c} by the template[/yellow]")
+                pinning["daq_application"][apps]["threads"][t] = str(cpus[c])
+
+    for apps in pinning["daq_application"]:
+        numa = app_numa[apps] if app_numa is not None else numa_from_name(apps)
 
         ccp_cores = None
         rawproc_cores = None
@@ -471,7 +693,7 @@ def fill_pinning(pinning : dict, cpus : CPUList, max_cpus : dict[int], n_regions
             if "tpproc" in t:
                 pinning["daq_application"][apps]["threads"][t] = cpu_list_to_str(assign_cpus_tpproc(n_regions, cpus, numa, max_cpus["tpproc"]))
             elif "rte-worker" in t:
-                pinning["daq_application"][apps]["threads"][t] = str(cpus[int(t.split("-")[-1])])
+                continue
             elif "rawproc" in t:
                 rawproc_cores = cpu_list_to_str(assign_cpus_rawproc(n_regions, cpus, numa, max_cpus["rawproc"]))
                 pinning["daq_application"][apps]["threads"][t] = rawproc_cores
@@ -487,6 +709,515 @@ def fill_pinning(pinning : dict, cpus : CPUList, max_cpus : dict[int], n_regions
     return pinning
 
 
+def get_device_numa(host : str, device : str) -> int | None:
+    """ Get the numa node of a device.
+
+    Args:
+        host (str): Server host name.
+        device (str): PCI address (e.g. 0000:17:00.0) or network interface name.
+
+    Returns:
+        int | None: Numa node, None if it could not be found.
+    """
+    if ":" in device:
+        path = f"/sys/bus/pci/devices/{device}/numa_node"
+    else:
+        path = f"/sys/class/net/{device}/device/numa_node"
+    out = parse_output(run_command(host, f"cat {path}"))
+    try:
+        return int(out[0])
+    except (IndexError, ValueError):
+        return None
+
+
+def get_device_cpus(host : str, device : str) -> list[int] | None:
+    """ Get the cpus local to a device, as reported by the kernel (usually all the cpus of its numa node).
+
+    Args:
+        host (str): Server host name.
+        device (str): PCI address (e.g. 0000:17:00.0) or network interface name.
+
+    Returns:
+        list[int] | None: Local cpus, None if they could not be found.
+    """
+    if ":" in device:
+        path = f"/sys/bus/pci/devices/{device}/local_cpulist"
+    else:
+        path = f"/sys/class/net/{device}/device/local_cpulist"
+    out = parse_output(run_command(host, f"cat {path}"))
+    try:
+        return str_to_cpu_list(out[0])
+    except (IndexError, ValueError):
+        return None
+
+
+def assign_numa(apps : dict[str, dict], host : str, numa_cpus : dict[int, set[int]]) -> dict[str, int]:
+    """ Assign the daq applications of a template to numa nodes.
+
+    An application with a "device" (PCI address or network interface it reads from) is placed on the numa node of
+    the device. An application without one, whose rte-worker cpus are fixed by the template on one numa node, is
+    placed on that node. The others are placed one by one, largest declared input "rate" first, on the numa node with
+    the lowest total rate. If no application has a device or a rate, the numa node is taken from the application name.
+    The placement is per numa node only, the cache (L3) topology within a numa node is not taken into account.
+
+    Args:
+        apps (dict[str, dict]): Daq applications of the template.
+        host (str): Server host name.
+        numa_cpus (dict[int, set[int]]): CPUs of each numa node.
+
+    Returns:
+        dict[str, int]: Numa of each daq application.
+    """
+    if not any(("device" in v) or ("rate" in v) for v in apps.values()):
+        return {k : numa_from_name(k) for k in apps}
+
+    n_numa = len(numa_cpus)
+    app_numa = {}
+    load = [[0, 0] for _ in range(n_numa)] # total rate and number of applications per numa
+    for k, v in apps.items():
+        numa = None
+        if "device" in v:
+            numa = get_device_numa(host, v["device"])
+            if (numa == -1) and (n_numa == 1): # no numa information, e.g. a single socket server
+                numa = 0
+            if (numa is not None) and (0 <= numa < n_numa):
+                print(f"{k}: device {v['device']} is on numa {numa}")
+            else:
+                print(f"[yellow]WARNING: numa of device {v['device']} of {k} could not be found[/yellow]")
+                numa = None
+        if numa is None:
+            rte = [int(t.split("-")[-1]) for t in v.get("threads", {}) if "rte-worker" in t]
+            nodes = {n for n, c in numa_cpus.items() if c & set(rte)}
+            if len(nodes) == 1:
+                numa = nodes.pop()
+                print(f"{k}: rte-worker cpus {rte} are on numa {numa}")
+            else:
+                if len(nodes) > 1:
+                    print(f"[yellow]WARNING: rte-worker cpus {rte} of {k} are on numa nodes {sorted(nodes)}[/yellow]")
+                continue # placed by rate below
+        app_numa[k] = numa
+        load[numa][0] += v.get("rate", 0)
+        load[numa][1] += 1
+
+    for k in sorted([k for k in apps if k not in app_numa], key = lambda k : -apps[k].get("rate", 0)):
+        numa = min(range(n_numa), key = lambda n : load[n])
+        print(f"{k}: placed on numa {numa} by rate ({apps[k].get('rate', 0)})")
+        app_numa[k] = numa
+        load[numa][0] += apps[k].get("rate", 0)
+        load[numa][1] += 1
+    return {k : app_numa[k] for k in apps}
+
+
+def check_locality(pinning : dict, app_numa : dict[str, int], numa_cpus : dict[int, set[int]], device_cpus : dict[str, set[int]]) -> list[str]:
+    """ Find threads pinned away from the numa node, or the cpus local to the device, of their daq application.
+
+    The device local cpus are only checked, not used to place the threads.
+
+    Args:
+        pinning (dict): Pinning configuration.
+        app_numa (dict[str, int]): Numa of each daq application.
+        numa_cpus (dict[int, set[int]]): CPUs of each numa node.
+        device_cpus (dict[str, set[int]]): CPUs local to the device of each daq application that has one.
+
+    Returns:
+        list[str]: Warnings.
+    """
+    warnings = []
+    for app, roles in pinned_roles(pinning).items():
+        for role, used in roles.items():
+            remote = used - numa_cpus[app_numa[app]]
+            if remote:
+                warnings.append(f"{role} threads of {app} are pinned to cpus {sorted(remote)}, which are not on numa {app_numa[app]}")
+            elif (app in device_cpus) and (used - device_cpus[app]):
+                warnings.append(f"{role} threads of {app} are pinned to cpus {sorted(used - device_cpus[app])}, which are not local to its device")
+    return warnings
+
+
+def define_regions(numa_dict : dict) -> int:
+    """ Define the cpu regions i.e. if the cpu has hypercores assigned to the different numas
+    e.g. 0,32, 63,95, these will be defined as two distinct regions. The regions are added to numa_dict.
+
+    Args:
+        numa_dict (dict): Numa information.
+
+    Returns:
+        int: Number of regions per numa.
+    """
+    for numa in numa_dict:
+        cpus = numa_dict[numa]["cpus"]
+        min_stride = min([cpus[i] - cpus[i-1] for i in range(1, len(numa_dict[numa]["cpus"]))])
+        region_boundaries = []
+        for i in range(1, len(numa_dict[numa]["cpus"])):
+            if (cpus[i] - cpus[i-1]) > min_stride:
+                region_boundaries.append(i)
+        if len(region_boundaries) > 1:
+            raise Exception("more than two regions has not been supported yet.")
+        elif len(region_boundaries) == 0:
+            print("only one region was found")
+            n_regions = 1
+            numa_dict[numa]["regions"] = cpus
+        else:
+            n_regions = 2
+            numa_dict[numa]["regions"] = [cpus[:region_boundaries[0]], cpus[region_boundaries[0]:]]
+    return n_regions
+
+
+def make_app_names(prefix : str, num_apps : int, numa_nodes : list[int], n_numa : int) -> tuple[list[str], list[int], dict[str, int]]:
+    """ Create daq application names, spreading the applications over the numa nodes.
+
+    Args:
+        prefix (str): Application name prefix.
+        num_apps (int): Number of daq applications.
+        numa_nodes (list[int]): Numa nodes to spread the applications over.
+        n_numa (int): Total number of numa nodes.
+
+    Returns:
+        tuple[list[str], list[int], dict[str, int]]: Application names, number of applications per numa node and numa of each application.
+    """
+    app_names = []
+    app_numa = {}
+    split = num_apps // len(numa_nodes)
+    numa_apps = [0] * n_numa
+    for i in numa_nodes:
+        for j in range(split):
+            if (num_apps == len(numa_nodes)):
+                app_name = f"{prefix}{i}"
+            else:
+                app_name = f"{prefix}{i}{j}"
+            app_names.append(app_name)
+            app_numa[app_name] = i
+            numa_apps[i] += 1
+
+    if (num_apps % len(numa_nodes)) > 0:
+        for i in numa_nodes:
+            if len(app_names) < num_apps:
+                app_names.append(f"{prefix}{i}{split + i}")
+                app_numa[app_names[-1]] = i
+                numa_apps[i] += 1
+            else:
+                break
+    return app_names, numa_apps, app_numa
+
+
+def get_thread_nums(readout_server : str) -> dict[int]:
+    """ Number of threads per daq application, depending on the readout plane assembly.
+
+    Args:
+        readout_server (str): Server host name.
+
+    Returns:
+        dict[int]: Number of threads of each type.
+    """
+    # define the number of threads per APA
+    # as done for np04-srv-031
+    n_threads_APA = {
+        "rte" : 4,
+        "tpproc" : 1,
+        "rawproc" : 1,
+        "cleanup" : 1,
+        "consumer" : 1,
+        "periodic" : 1,
+        "recording" : 1,
+    }
+
+    # as done for np02-srv-003eth0 (not for eth1???)
+    n_threads_CRP = {
+        "rte" : 6,
+        "tpproc" : 3,
+        "rawproc" : 1,
+        "cleanup" : 4,
+        "consumer" : 4,
+        "periodic" : 3,
+        "recording" : 1,
+    }
+
+    # use the correct number of threads depending on the readout plane assembly
+    if "np02" in readout_server:
+        return n_threads_CRP
+    elif "np04" in readout_server:
+        return n_threads_APA
+    else:
+        raise Exception(f"do not know what readout plane is used for {readout_server}")
+
+
+def flatten_regions(regions : list, n_regions : int) -> list[int]:
+    """ Flat list of the CPUs of a numa node.
+
+    Args:
+        regions (list): CPUs of the numa node, split into regions if n_regions > 1.
+        n_regions (int): Number of regions in the numa.
+
+    Returns:
+        list[int]: CPUs.
+    """
+    return list(regions) if n_regions == 1 else [c for r in regions for c in r]
+
+
+def check_sessions(sessions : dict[str, dict], n_numa : int):
+    """ Check the session quotas before the host is partitioned.
+
+    Args:
+        sessions (dict[str, dict]): Quota of each session.
+        n_numa (int): Number of numa nodes of the host.
+
+    Raises:
+        Exception: A quota is missing or out of range.
+    """
+    if len(sessions) == 0:
+        raise Exception("no sessions were given")
+    for s, q in sessions.items():
+        if not isinstance(q.get("numa"), list) or len(q["numa"]) == 0:
+            raise Exception(f"session {s} must give its numa nodes as a non-empty list e.g. \"numa\": [0]")
+        bad = [n for n in q["numa"] if not isinstance(n, int) or not (0 <= n < n_numa)]
+        if bad:
+            raise Exception(f"session {s} asks for numa nodes {bad}, the host has numa nodes 0 to {n_numa - 1}")
+        if len(set(q["numa"])) != len(q["numa"]):
+            raise Exception(f"session {s} lists a numa node more than once: {q['numa']}")
+        for key in ["cores", "num_apps"]:
+            if (key in q) and (not isinstance(q[key], int) or q[key] < 1):
+                raise Exception(f"session {s}: \"{key}\" must be a positive integer, not {q[key]}")
+
+
+def shared_mem_nodes(sessions : dict[str, dict]) -> dict[str, dict[str, list[str]]]:
+    """ Numa nodes whose memory a session shares with other sessions.
+
+    Args:
+        sessions (dict[str, dict]): Quota of each session.
+
+    Returns:
+        dict[str, dict[str, list[str]]]: Per session, the other sessions bound to each of its shared numa nodes.
+    """
+    shared = {}
+    for s, q in sessions.items():
+        shared[s] = {}
+        for n in q["numa"]:
+            others = [o for o, p in sessions.items() if (o != s) and (n in p["numa"])]
+            if others:
+                shared[s][str(n)] = others
+    return shared
+
+
+def partition_cpus(remaining_regions : list, n_regions : int, sessions : dict[str, dict]) -> dict[str, list]:
+    """ Split the available CPUs between sessions, according to their quotas.
+
+    Each numa node is divided into contiguous slices of physical cores (with hypercores, the n-th cpu of each region), in the order the sessions are declared.
+    A session quota is a list of numa nodes and, optionally, the number of physical cores per numa node. At most one session per numa node may leave the
+    number of cores out, it gets what is left of the numa node.
+
+    Args:
+        remaining_regions (list): Available CPUs per numa node (and region).
+        n_regions (int): Number of regions in the numa.
+        sessions (dict[str, dict]): Quota of each session.
+
+    Raises:
+        Exception: The quotas do not fit in a numa node.
+        Exception: Two sessions were given the same CPU.
+
+    Returns:
+        dict[str, list]: Available CPUs per numa node (and region) for each session.
+    """
+    partition = {s : [[] if n_regions == 1 else [[] for _ in range(n_regions)] for _ in remaining_regions] for s in sessions}
+    for numa, regions in enumerate(remaining_regions):
+        n_slots = len(regions) if n_regions == 1 else min(len(r) for r in regions)
+        users = [s for s, q in sessions.items() if numa in q["numa"]]
+        fixed = sum(sessions[s]["cores"] for s in users if "cores" in sessions[s])
+        if len([s for s in users if "cores" not in sessions[s]]) > 1:
+            raise Exception(f"more than one session takes the rest of numa {numa}, give all but one of them a number of cores")
+        if fixed > n_slots:
+            raise Exception(f"sessions {users} request {fixed} cores of numa {numa}, but only {n_slots} are available")
+
+        start = 0
+        for s in users:
+            n = sessions[s].get("cores", n_slots - fixed)
+            if n_regions == 1:
+                partition[s][numa] = list(regions[start:start + n])
+            else:
+                partition[s][numa] = [list(r[start:start + n]) for r in regions]
+            start += n
+
+    owner = {}
+    for s, numa_regions in partition.items():
+        for regions in numa_regions:
+            for c in flatten_regions(regions, n_regions):
+                if c in owner:
+                    raise Exception(f"cpu {c} was given to both sessions {owner[c]} and {s}")
+                owner[c] = s
+    return partition
+
+
+def required_cpus(max_cpus : dict[int], thread_nums : dict[int]) -> dict[str, int]:
+    """ Number of cpus each thread type of a daq application should get.
+
+    Args:
+        max_cpus (dict[int]): Number of cpus to assign to each thread type.
+        thread_nums (dict[int]): Number of threads per daq application.
+
+    Returns:
+        dict[str, int]: Number of cpus per thread type.
+    """
+    return {
+        "rte-worker" : thread_nums["rte"] * max_cpus["rte"],
+        "tpproc" : max_cpus["tpproc"],
+        "rawproc" : max_cpus["rawproc"],
+        "cleanup" : max_cpus["ccp"],
+        "consumer" : max_cpus["ccp"],
+        "periodic" : max_cpus["ccp"],
+        "recording" : max_cpus["recording"],
+    }
+
+
+def check_allocation(pinning : dict, required : dict[str, int]) -> list[str]:
+    """ Find thread types that got fewer cpus than requested.
+
+    Args:
+        pinning (dict): Pinning configuration.
+        required (dict[str, int]): Number of cpus per thread type.
+
+    Returns:
+        list[str]: Thread types short of cpus, per daq application.
+    """
+    short = []
+    for app, roles in pinned_roles(pinning).items():
+        for role, n in required.items():
+            got = len(roles.get(role, set()))
+            if got < n:
+                short.append(f"{role} threads of {app} got {got} of the {n} cpus requested")
+    return short
+
+
+def check_smt(pinning : dict, siblings : dict[int, int], args : argparse.Namespace):
+    """ Run the SMT neighbour check if a compatibility matrix was given.
+
+    Args:
+        pinning (dict): Pinning configuration.
+        siblings (dict[int, int]): SMT sibling of each CPU, None if they are not known.
+        args (argparse.Namespace): Command line arguments.
+    """
+    if not args.smt_matrix:
+        return
+    if siblings is None:
+        print("[yellow]WARNING: SMT siblings are not known when there is only one region, skipping the SMT neighbour check[/yellow]")
+        return
+    with open(args.smt_matrix, "r") as f:
+        compatible = json.load(f)["compatible"]
+    problems = check_smt_neighbours(pinning, siblings, compatible)
+    for p in problems:
+        print(f"[yellow]WARNING: {p}[/yellow]")
+    if problems and args.smt_strict:
+        raise Exception(f"{len(problems)} incompatible SMT neighbours in the pinning")
+
+
+def create_session_pinnings(args : argparse.Namespace, sessions : dict[str, dict], remaining_regions : list, n_regions : int, daq_app_names : str, max_cpus : dict[int], noisy : set[int], siblings : dict[int, int]):
+    """ Partition the host between sessions and write a pinning for each of them, from its own CPUs only.
+
+    Args:
+        args (argparse.Namespace): Command line arguments.
+        sessions (dict[str, dict]): Quota of each session: numa nodes ("numa"), physical cores per numa node ("cores"), number of daq applications ("num_apps"),
+            devices ("devices") and whether its numa nodes must not be shared with other sessions ("exclusive_memory").
+        remaining_regions (list): Available CPUs per numa node (and region).
+        n_regions (int): Number of regions in the numa.
+        daq_app_names (str): Application name prefix of the host.
+        max_cpus (dict[int]): Number of cpus to assign to each thread type.
+        noisy (set[int]): Noisy CPUs.
+        siblings (dict[int, int]): SMT sibling of each CPU, None if they are not known.
+
+    Raises:
+        Exception: A session asked for exclusive memory on a numa node shared with another session.
+    """
+    check_sessions(sessions, len(remaining_regions))
+
+    # the cpus are split, but the memory of a numa node is shared by all the sessions bound to it
+    shared = shared_mem_nodes(sessions)
+    for s, nodes in shared.items():
+        for n, others in nodes.items():
+            if sessions[s].get("exclusive_memory"):
+                raise Exception(f"session {s} asks for exclusive memory, but numa {n} is also used by sessions {others}")
+            print(f"[yellow]WARNING: session {s} shares the memory of numa {n} with sessions {others}[/yellow]")
+
+    partition = partition_cpus(remaining_regions, n_regions, sessions)
+
+    # devices belong to one session, on one of its numa nodes
+    device_owner = {}
+    for s, q in sessions.items():
+        for d in q.get("devices", []):
+            if d in device_owner:
+                raise Exception(f"device {d} was given to both sessions {device_owner[d]} and {s}")
+            device_owner[d] = s
+            node = get_device_numa(args.readout_server, d)
+            if (node is None) or (node < 0): # -1: the device has no numa information
+                print(f"[yellow]WARNING: numa of device {d} of session {s} could not be found, it is not checked[/yellow]")
+            elif node not in q["numa"]:
+                raise Exception(f"device {d} of session {s} is on numa {node}, which is not one of the session numa nodes {q['numa']}")
+
+    thread_nums = get_thread_nums(args.readout_server)
+    required = required_cpus(max_cpus, thread_nums)
+    total_cpus_used = sum(v for k, v in max_cpus.items() if k != "rte") + required["rte-worker"]
+
+    # make and validate the pinning of every session before anything is written
+    summary = {}
+    session_pinned = {}
+    outputs = {}
+    for s, q in sessions.items():
+        numa_nodes = sorted(q["numa"])
+        session_cpus = [c for regions in partition[s] for c in flatten_regions(regions, n_regions)]
+        prefix = f"{s}-{daq_app_names}"
+        app_names, numa_apps, app_numa = make_app_names(prefix, q.get("num_apps", len(numa_nodes)), numa_nodes, len(remaining_regions))
+        app_numa = {"--name " + name : numa for name, numa in app_numa.items()}
+
+        for numa in numa_nodes:
+            headroom = len(flatten_regions(partition[s][numa], n_regions)) // max(numa_apps[numa], 1) - total_cpus_used
+            print(f"session {s} numa {numa}: headroom per daq application: {headroom}")
+            if headroom < 0:
+                raise Exception(f"session {s} does not have enough cpus on numa {numa} for {numa_apps[numa]} daq application(s)")
+
+        pinning = {"daq_application" : {"--name " + name : {} for name in app_names}}
+        cpus = CPUList(list(session_cpus), copy.deepcopy(partition[s]), noisy)
+        for numa in numa_nodes:
+            create_threads_numa(pinning, cpus, numa, prefix, thread_nums, n_regions, numa_apps, max_cpus, app_numa)
+
+        # hard guarantee: the session threads only use the session cpus
+        session_pinned[s] = pinned_cpus(pinning)
+        outside = session_pinned[s] - set(session_cpus)
+        if outside:
+            raise Exception(f"session {s} pinning uses cpus outside of its partition: {sorted(outside)}")
+        short = check_allocation(pinning, required)
+        if short:
+            raise Exception(f"session {s} does not have enough cpus: " + "; ".join(short))
+        check_smt(pinning, siblings, args)
+
+        # before the configuration, the parent can use all the session cpus of its numa node
+        pinning_pre_conf = copy.deepcopy(pinning)
+        for name, numa in app_numa.items():
+            pinning_pre_conf["daq_application"][name]["parent"] = cpu_list_to_str(sorted(flatten_regions(partition[s][numa], n_regions)))
+
+        outputs[f"cpupin-{s}-running.json"] = pinning
+        outputs[f"cpupin-{s}.json"] = pinning_pre_conf
+
+        summary[s] = {
+            "cpus" : cpu_list_to_str(sorted(session_cpus)),
+            "mem_nodes" : numa_nodes,
+            "shared_mem_nodes" : shared[s],
+            "devices" : q.get("devices", []),
+            "numactl" : f"numactl --membind={','.join(str(n) for n in numa_nodes)}",
+            "daq_application" : list(pinning["daq_application"].keys()),
+        }
+
+    for s1 in session_pinned:
+        for s2 in session_pinned:
+            if (s1 < s2) and (session_pinned[s1] & session_pinned[s2]):
+                raise Exception(f"sessions {s1} and {s2} share cpus {sorted(session_pinned[s1] & session_pinned[s2])}")
+
+    for n, p in outputs.items():
+        with open(n, "w") as f:
+            json.dump(p, f, indent = 4)
+        print(f"pinning has been written to {n}")
+
+    with open("partition.json", "w") as f:
+        json.dump(summary, f, indent = 4)
+    print("partition has been written to partition.json")
+    return
+
+
 def main(args = argparse.Namespace):
     daq_app_names = f"ru{args.readout_server.replace('-', '')}eth"
 
@@ -521,53 +1252,48 @@ def main(args = argparse.Namespace):
 
     n_cpus_total = len(cpus_all)
 
-    # define the cpu regions i.e. if the cpu has hypercores assigned to the different numas
-    # e.g. 0,32, 63,95, these will be defined as two distinct regions
-    for numa in numa_dict:
-        cpus = numa_dict[numa]["cpus"]
-        min_stride = min([cpus[i] - cpus[i-1] for i in range(1, len(numa_dict[numa]["cpus"]))])
-        region_boundaries = []
-        for i in range(1, len(numa_dict[numa]["cpus"])):
-            if (cpus[i] - cpus[i-1]) > min_stride:
-                region_boundaries.append(i)
-        if len(region_boundaries) > 1:
-            raise Exception("more than two regions has not been supported yet.")
-        elif len(region_boundaries) == 0:
-            print("only one region was found")
-            n_regions = 1
-            numa_dict[numa]["regions"] = cpus
-        else:
-            n_regions = 2
-            numa_dict[numa]["regions"] = [cpus[:region_boundaries[0]], cpus[region_boundaries[0]:]]
+    n_regions = define_regions(numa_dict)
+
+    # the n-th cpu of each region of a numa node are hyperthreads of the same physical core
+    siblings = None
+    if n_regions == 2:
+        siblings = {}
+        for v in numa_dict.values():
+            for c0, c1 in zip(v["regions"][0], v["regions"][1]):
+                siblings[c0], siblings[c1] = c1, c0
 
     cpus_remaining = list(cpus_all)
-    remaining_regions = [list(v["regions"]) for v in numa_dict.values()]
+    remaining_regions = copy.deepcopy([v["regions"] for v in numa_dict.values()]) # the regions of numa_dict are kept whole for the pre-configuration
 
     # how many cores should be assigned to a single thread (sharing rules are omitted here). Taken from np04-srv-031 pinning
     max_cpus = {k : getattr(args, k) for k in max_cpus_default}
     total_cpus_used = sum(v for v in max_cpus.values())
 
-    # create daq application names
-    app_names = []
-    split = args.num_apps // n_numa
-    numa_apps = []
-    for i in range(n_numa):
-        numa_apps.append(0)
-        for j in range(split):
-            if (args.num_apps == n_numa):
-                app_name = f"{daq_app_names}{i}"
-            else:
-                app_name = f"{daq_app_names}{i}{j}"
-            app_names.append(app_name)
-            numa_apps[i] += 1
+    # remove first thread and hypercore on each numa node
+    for i, v in enumerate(numa_dict.values()):
+        if n_regions == 1:
+            cpus_remaining.remove(v["regions"][0])
+            remaining_regions[i].pop(0)
+        else: # must have hypercores
+            for r in range(n_regions):
+                cpus_remaining.remove(v["regions"][r][0])
+                remaining_regions[i][r].pop(0)
+
+    noisy = set()
+    if args.noise_profile:
+        noisy = load_noisy_cores(args.noise_profile, args.noise_threshold)
+        print(f"noisy cpus kept away from rawproc and rte-worker threads: {sorted(noisy)}")
+
+    if args.partition:
+        if args.template:
+            raise Exception("template mode is not supported together with sessions")
+        with open(args.partition, "r") as f:
+            sessions = json.load(f)["sessions"]
+        create_session_pinnings(args, sessions, remaining_regions, n_regions, daq_app_names, max_cpus, noisy, siblings)
+        return
 
-    if (args.num_apps % n_numa) > 0:
-        for i in range(n_numa):
-            if len(app_names) < args.num_apps:
-                app_names.append(f"{daq_app_names}{i}{split + i}")
-                numa_apps[i] += 1
-            else:
-                break
+    # create daq application names
+    app_names, numa_apps, app_numa = make_app_names(daq_app_names, args.num_apps, list(range(n_numa)), n_numa)
 
     #! this should be read from the oks config
     pinning = {"daq_application" : {}}
@@ -586,84 +1312,51 @@ def main(args = argparse.Namespace):
                 for t in v["threads"]:
                     pinning["daq_application"][k]["threads"][t] = None
 
+        # place the applications next to the devices they read from
+        numa_cpus = {int(k) : set(v["cpus"]) for k, v in numa_dict.items()}
+        app_numa = assign_numa(template["daq_application"], args.readout_server, numa_cpus)
+        device_cpus = {}
+        for k, v in template["daq_application"].items():
+            if "device" in v:
+                local = get_device_cpus(args.readout_server, v["device"])
+                if local:
+                    device_cpus[k] = set(local)
+
     else:
         for name in app_names:
             pinning["daq_application"]["--name " + name] = {}
+        app_numa = {"--name " + name : numa for name, numa in app_numa.items()}
 
-        # define the number of threads per APA
-        # as done for np04-srv-031
-        n_threads_APA = {
-            "rte" : 4,
-            "tpproc" : 1,
-            "rawproc" : 1,
-            "cleanup" : 1,
-            "consumer" : 1,
-            "periodic" : 1,
-            "recording" : 1,
-        }
-
-        # as done for np02-srv-003eth0 (not for eth1???)
-        n_threads_CRP = {
-            "rte" : 6,
-            "tpproc" : 3,
-            "rawproc" : 1,
-            "cleanup" : 4,
-            "consumer" : 4,
-            "periodic" : 3,
-            "recording" : 1,
-        }
-
-        # use the correct number of threads depending on the readout plane assembly
-        if "np02" in args.readout_server:
-            thread_nums = n_threads_CRP
-        elif "np04" in args.readout_server:
-            thread_nums = n_threads_APA
-        else:
-            raise Exception(f"do not know what readout plane is used for {args.readout_server}")
+        thread_nums = get_thread_nums(args.readout_server)
 
     cores_per_app = n_cpus_total // len(app_names)
 
-    # remove first thread and hypercore on each numa node
-    if n_regions == 1:
-        cpus_remaining.remove(numa_dict["0"]["regions"][0])
-        cpus_remaining.remove(numa_dict["1"]["regions"][0])
-        remaining_regions[0].pop(0)
-        remaining_regions[1].pop(0)
-
-    else: # must have hypercores
-        cpus_remaining.remove(numa_dict["0"]["regions"][0][0])
-        cpus_remaining.remove(numa_dict["0"]["regions"][1][0])
-        cpus_remaining.remove(numa_dict["1"]["regions"][0][0])
-        cpus_remaining.remove(numa_dict["1"]["regions"][1][0])
-
-        remaining_regions[0][0].pop(0)
-        remaining_regions[0][1].pop(0)
-        remaining_regions[1][0].pop(0)
-        remaining_regions[1][1].pop(0)
-
     print(f"headroom per daq application: {cores_per_app - total_cpus_used}") # printout the available headroom per application after removing the primary core and hpyercore
 
     # make the pinning configuration for running with the DAQ
-    cpus = CPUList(list(cpus_remaining), list(remaining_regions))
+    cpus = CPUList(list(cpus_remaining), list(remaining_regions), noisy)
 
     if args.template:
-        fill_pinning(pinning, cpus, max_cpus, n_regions)
+        fill_pinning(pinning, cpus, max_cpus, n_regions, app_numa)
+        for w in check_locality(pinning, app_numa, numa_cpus, device_cpus):
+            print(f"[yellow]WARNING: {w}[/yellow]")
     else:
         for i in range(n_numa):
-            create_threads_numa(pinning, cpus, i, daq_app_names, thread_nums, n_regions, numa_apps, max_cpus)
+            create_threads_numa(pinning, cpus, i, daq_app_names, thread_nums, n_regions, numa_apps, max_cpus, app_numa)
+
+    check_smt(pinning, siblings, args)
 
     # print created pinning and remaning cpus that were not assigned (excluding the first core and hypercore.)
     print(pinning)
     print("remaining cpus:")
     print(cpus.cpu_list_regions)
 
-    cpus = CPUList(list(cpus_all), [v["regions"] for v in numa_dict.values()])
+    # before the configuration, the parent can use all the cpus of its numa node
+    numa_regions = [v["regions"] for v in numa_dict.values()]
     pinning_pre_conf = copy.deepcopy(pinning)
 
-    app_names = list(pinning["daq_application"].keys())
-    for i in range(len(numa_apps)):
-        for j in range(numa_apps[i]):
-            pinning_pre_conf["daq_application"][app_names[i + j]]["parent"] = cpu_list_to_str(cpus.cpu_list_regions[i])
+    for name, numa in app_numa.items():
+        pinning_pre_conf["daq_application"][name]["parent"] = cpu_list_to_str(sorted(flatten_regions(numa_regions[numa], n_regions)))
 
     # write to a json file
     for p, n in zip([pinning, pinning_pre_conf],["cpupin-all-running.json", "cpupin-all.json"]):
@@ -688,6 +1381,11 @@ if __name__ == "__main__":
     parser.add_argument("-f", "--fake", action="store_true", help = "fake the numactl output for the specified readout machine.")
     parser.add_argument("-n", "--num_apps", type = int, default = 1, help = "number of daq_applications to make.")
     parser.add_argument("-t", "--template", type = str, help = "pinning file template. must be a json file.")
+    parser.add_argument("--noise_profile", type = str, help = "noise profile json file made by noise_profile.py, used to keep latency critical threads off noisy cpus.")
+    parser.add_argument("--noise_threshold", type = float, default = None, help = "noise score above which a cpu is considered noisy, defaults to twice the median score.")
+    parser.add_argument("--smt_matrix", type = str, help = "compatibility matrix json file made by smt_interference.py, used to check which thread types are SMT neighbours.")
+    parser.add_argument("--smt_strict", action = "store_true", help = "fail instead of warning when incompatible thread types are SMT neighbours.")
+    parser.add_argument("-p", "--partition", type = str, help = "json file of sessions sharing the host, with their quotas. a pinning file is made for each session from its own share of the cpus.")
 
     for k, v in max_cpus_default.items():
         if k == "ccp":
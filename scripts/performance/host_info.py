@@ -0,0 +1,88 @@
+"""
+Description: sysfs and procfs helpers shared by the performance scripts.
+
+All paths are given explicitly (or relative to a sysfs root), so the helpers can be
+used on a copy of the sysfs/procfs trees.
+"""
+import os
+
+# PCIe device categories, matching the lspci names looked up by auto-discovery.py
+PCI_VENDORS = {"0x10ee" : "Xilinx", "0x10dc" : "CERN"}
+PCI_CLASSES = {"0x0200" : "Ethernet", "0x0108" : "Non-Volatile"}
+
+
+def read_value(path : str) -> str | None:
+    """ Read a sysfs attribute.
+
+    Args:
+        path (str): Attribute path.
+
+    Returns:
+        str | None: Stripped content, or None if the attribute does not exist (anymore).
+    """
+    try:
+        with open(path, "r") as f:
+            return f.read().strip()
+    except (FileNotFoundError, NotADirectoryError, ProcessLookupError): # ProcessLookupError: /proc entry of an exiting process
+        return None
+
+
+def write_value(path : str, value : str):
+    """ Write a sysfs attribute.
+
+    Args:
+        path (str): Attribute path.
+        value (str): Value to write.
+    """
+    with open(path, "w") as f:
+        f.write(str(value))
+
+
+def read_mdstat(path : str) -> dict[str, dict]:
+    """ Parse /proc/mdstat.
+
+    Args:
+        path (str): mdstat file.
+
+    Returns:
+        dict[str, dict]: Per md device: state, drives, and number of configured/working drives.
+    """
+    raids = {}
+    text = read_value(path)
+    if text is None:
+        return raids
+    current = None
+    for line in text.splitlines():
+        words = line.split()
+        if len(words) > 2 and words[1] == ":" and words[0].startswith("md"):
+            current = words[0]
+            raids[current] = {"state" : words[2], "drives" : [w.split("[")[0] for w in words[4:] if "[" in w], "devices" : None, "active" : None}
+        elif current and "[" in line and "/" in line and line.rstrip().endswith("]"):
+            # e.g. "1875118080 blocks super 1.2 [4/4] [UUUU]"
+            total, active = [w for w in words if "/" in w][-1].strip("[]").split("/")
+            raids[current]["devices"] = int(total)
+            raids[current]["active"] = int(active)
+        elif not line.strip():
+            current = None
+    return raids
+
+
+def read_pci_devices(sysfs_root : str) -> list[tuple[str, str, str]]:
+    """ Readout relevant PCIe devices with their category and NUMA node.
+
+    Args:
+        sysfs_root (str): sysfs mount point.
+
+    Returns:
+        list[tuple[str, str, str]]: PCI address, category and NUMA node of each device.
+    """
+    pci_dir = os.path.join(sysfs_root, "bus", "pci", "devices")
+    devices = []
+    if os.path.isdir(pci_dir):
+        for dev in sorted(os.listdir(pci_dir)):
+            vendor = read_value(os.path.join(pci_dir, dev, "vendor"))
+            pci_class = (read_value(os.path.join(pci_dir, dev, "class")) or "")[:6]
+            category = PCI_VENDORS.get(vendor, PCI_CLASSES.get(pci_class))
+            if category:
+                devices.append((dev, category, read_value(os.path.join(pci_dir, dev, "numa_node")) or "-1"))
+    return devices
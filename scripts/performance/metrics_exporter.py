@@ -0,0 +1,310 @@
+#!/usr/bin/env python
+"""
+Description: Export the readout host topology, diagnostics and pinning health as OpenMetrics.
+
+The metrics are written either to a node-exporter textfile (--textfile) or served on a
+small local HTTP endpoint (--port), so they can be scraped every few seconds.
+
+To keep the cost of a scrape low, the static topology (NUMA cpus, PCIe device locality)
+is read once and cached, only the live counters (free memory, /proc/stat, /proc/mdstat,
+RAID usage) are re-read, and the diagnostics, which run external commands, are only
+re-evaluated every --diag_interval seconds.
+
+    daq_numa_cpus{node}                         cpus in the NUMA node
+    daq_numa_memory_size_bytes{node}            memory of the NUMA node
+    daq_numa_memory_free_bytes{node}            free memory of the NUMA node
+    daq_device_info{device,category,node}       PCIe device locality
+    daq_raid_devices{raid}                      number of drives in the RAID
+    daq_raid_devices_active{raid}               number of working drives in the RAID
+    daq_raid_size_bytes{raid,mount}             RAID filesystem size
+    daq_raid_used_bytes{raid,mount}             RAID filesystem usage
+    daq_diagnostic_ok{check}                    1 if the diagnostic check passes
+    daq_role_cpu_utilisation_ratio{app,role}    mean utilisation of the cpus pinned to a thread type
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+import time
+
+from http.server import BaseHTTPRequestHandler, HTTPServer
+
+import psutil
+from rich import print
+
+from create_pinning_minimal import pinned_cpus, pinned_roles, str_to_cpu_list
+from host_info import read_mdstat, read_pci_devices, read_value
+from perf_mode import PowerControl
+
+SERVICES_OFF = ["irqbalance", "numad"] # services that should not run on a readout host
+
+
+class Collector:
+    """
+    Collect the metrics of a readout host.
+
+    Attributes
+    ----------
+    sysfs_root : str
+        sysfs mount point.
+    procfs_root : str
+        procfs mount point.
+    pinning : dict
+        Pinning configuration, None if not given.
+    diag_interval : float
+        Seconds between two evaluations of the diagnostics.
+    """
+    def __init__(self, sysfs_root : str = "/sys", procfs_root : str = "/proc", pinning : dict = None, diag_interval : float = 60) -> None:
+        self.sysfs_root = sysfs_root
+        self.procfs_root = procfs_root
+        self.pinning = pinning
+        self.diag_interval = diag_interval
+
+        self.numa_cpus = self.read_numa_cpus()
+        self.devices = read_pci_devices(sysfs_root) # static, read once
+        self.roles = pinned_roles(pinning) if pinning else {}
+
+        self.last_cpu_times = self.read_cpu_times()
+        self.diagnostics = {}
+        self.last_diag = None
+        pass
+
+
+    def read_numa_cpus(self) -> dict[str, list[int]]:
+        """ CPUs of each NUMA node (static, read once). """
+        node_dir = os.path.join(self.sysfs_root, "devices", "system", "node")
+        numa_cpus = {}
+        if os.path.isdir(node_dir):
+            for node in sorted(os.listdir(node_dir)):
+                if node.startswith("node") and node[4:].isdigit():
+                    numa_cpus[node[4:]] = str_to_cpu_list(read_value(os.path.join(node_dir, node, "cpulist")) or "")
+        return numa_cpus
+
+
+    def read_cpu_times(self) -> dict[int, tuple[int, int]]:
+        """ Busy and total jiffies per cpu from /proc/stat. """
+        times = {}
+        stat = read_value(os.path.join(self.procfs_root, "stat")) or ""
+        for line in stat.splitlines():
+            words = line.split()
+            if words and words[0].startswith("cpu") and words[0][3:].isdigit():
+                values = [int(v) for v in words[1:]]
+                idle = values[3] + (values[4] if len(values) > 4 else 0) # idle + iowait
+                times[int(words[0][3:])] = (sum(values) - idle, sum(values))
+        return times
+
+
+    def cpu_utilisation(self) -> dict[int, float]:
+        """ Utilisation of each cpu since the previous call. """
+        times = self.read_cpu_times()
+        utilisation = {}
+        for cpu, (busy, total) in times.items():
+            if cpu in self.last_cpu_times:
+                last_busy, last_total = self.last_cpu_times[cpu]
+                if total > last_total:
+                    utilisation[cpu] = (busy - last_busy) / (total - last_total)
+        self.last_cpu_times = times
+        return utilisation
+
+
+    def mounts(self) -> dict[str, str]:
+        """ Mount point of each mounted device. """
+        mounts = {}
+        for line in (read_value(os.path.join(self.procfs_root, "mounts")) or "").splitlines():
+            words = line.split()
+            if len(words) > 1:
+                mounts[os.path.realpath(words[0])] = words[1]
+        return mounts
+
+
+    def run_diagnostics(self, raids : dict[str, dict], mounts : dict[str, str]) -> dict[str, bool]:
+        """ Evaluate the diagnostic checks.
+
+        Args:
+            raids (dict[str, dict]): RAIDs from /proc/mdstat.
+            mounts (dict[str, str]): Mount point of each mounted device.
+
+        Returns:
+            dict[str, bool]: Verdict per check.
+        """
+        diagnostics = {}
+        for service in SERVICES_OFF:
+            try:
+                out = subprocess.run(["systemctl", "is-active", service], capture_output = True, text = True)
+            except FileNotFoundError:
+                continue # no systemd, the verdict is unknown
+            state = out.stdout.strip()
+            if state not in ["active", "inactive", "failed"]:
+                continue # systemd could not be reached (nothing on stdout) or the unit is changing state, the verdict is unknown
+            diagnostics[f"{service}_stopped"] = state != "active"
+        diagnostics["raids_mounted"] = all(f"/dev/{r}" in mounts for r in raids)
+        diagnostics["raids_healthy"] = all(r["devices"] == r["active"] for r in raids.values())
+        if self.pinning:
+            online = str_to_cpu_list(read_value(os.path.join(self.sysfs_root, "devices", "system", "cpu", "online")) or "")
+            cpus = pinned_cpus(self.pinning)
+            diagnostics["pinned_cpus_online"] = cpus.issubset(online)
+            profile = {"governor" : "performance", "epp" : "performance", "boost" : True, "max_latency" : 2, "lock_freq" : False}
+            control = PowerControl(self.sysfs_root, list(cpus))
+            # without any cpufreq/cpuidle attribute to check, the perf mode cannot be confirmed
+            checked = any(("/cpufreq/" in p) or ("/cpuidle/" in p) for p in control.expected(profile))
+            diagnostics["pinned_cpus_perf_mode"] = checked and len(control.verify(profile)) == 0
+        return diagnostics
+
+
+    def collect(self) -> list[tuple[str, str, str, list[tuple[dict, float]]]]:
+        """ Collect all metrics.
+
+        Returns:
+            list[tuple[str, str, str, list[tuple[dict, float]]]]: Metric families: name, type, help and the samples (labels, value).
+        """
+        families = []
+
+        numa_cpus = [({"node" : n}, len(c)) for n, c in self.numa_cpus.items()]
+        size, free = [], []
+        for node in self.numa_cpus:
+            meminfo = read_value(os.path.join(self.sysfs_root, "devices", "system", "node", f"node{node}", "meminfo")) or ""
+            for line in meminfo.splitlines():
+                words = line.split() # e.g. "Node 0 MemFree: 1234 kB"
+                if len(words) < 4:
+                    continue
+                if words[2] == "MemTotal:":
+                    size.append(({"node" : node}, int(words[3]) * 1024))
+                elif words[2] == "MemFree:":
+                    free.append(({"node" : node}, int(words[3]) * 1024))
+        families.append(("daq_numa_cpus", "gauge", "cpus in the NUMA node", numa_cpus))
+        families.append(("daq_numa_memory_size_bytes", "gauge", "memory of the NUMA node", size))
+        families.append(("daq_numa_memory_free_bytes", "gauge", "free memory of the NUMA node", free))
+
+        families.append(("daq_device", "info", "PCIe device locality", [({"device" : d, "category" : c, "node" : n}, 1) for d, c, n in self.devices]))
+
+        raids = read_mdstat(os.path.join(self.procfs_root, "mdstat"))
+        mounts = self.mounts()
+        families.append(("daq_raid_devices", "gauge", "number of drives in the RAID", [({"raid" : r}, v["devices"]) for r, v in raids.items() if v["devices"] is not None]))
+        families.append(("daq_raid_devices_active", "gauge", "number of working drives in the RAID", [({"raid" : r}, v["active"]) for r, v in raids.items() if v["active"] is not None]))
+        raid_size, raid_used = [], []
+        for r in raids:
+            mount = mounts.get(f"/dev/{r}")
+            if mount:
+                usage = psutil.disk_usage(mount)
+                raid_size.append(({"raid" : r, "mount" : mount}, usage.total))
+                raid_used.append(({"raid" : r, "mount" : mount}, usage.used))
+        families.append(("daq_raid_size_bytes", "gauge", "RAID filesystem size", raid_size))
+        families.append(("daq_raid_used_bytes", "gauge", "RAID filesystem usage", raid_used))
+
+        now = time.monotonic()
+        if self.last_diag is None or (now - self.last_diag) >= self.diag_interval:
+            self.diagnostics = self.run_diagnostics(raids, mounts)
+            self.last_diag = now
+        families.append(("daq_diagnostic_ok", "gauge", "1 if the diagnostic check passes", [({"check" : k}, int(v)) for k, v in self.diagnostics.items()]))
+
+        utilisation = self.cpu_utilisation()
+        role_util = []
+        for app, roles in self.roles.items():
+            for role, cpus in roles.items():
+                values = [utilisation[c] for c in cpus if c in utilisation]
+                if values:
+                    role_util.append(({"app" : app.replace("--name ", ""), "role" : role}, sum(values) / len(values)))
+        families.append(("daq_role_cpu_utilisation_ratio", "gauge", "mean utilisation of the cpus pinned to a thread type", role_util))
+        return families
+
+
+def render(families : list[tuple[str, str, str, list[tuple[dict, float]]]], openmetrics : bool = True) -> str:
+    """ Format metric families in the OpenMetrics / Prometheus text format.
+
+    Args:
+        families (list): Metric families from Collector.collect.
+        openmetrics (bool, optional): OpenMetrics format (info type, "# EOF"), otherwise Prometheus text format for the node-exporter textfile collector. Defaults to True.
+
+    Returns:
+        str: Exposition text.
+    """
+    lines = []
+    for name, kind, desc, samples in families:
+        if kind == "info" and not openmetrics:
+            name, kind = f"{name}_info", "gauge"
+        lines.append(f"# HELP {name} {desc}")
+        lines.append(f"# TYPE {name} {kind}")
+        for labels, value in samples:
+            sample = f"{name}_info" if kind == "info" else name
+            label_str = ",".join(f'{k}="{str(v)}"' for k, v in labels.items())
+            lines.append(f"{sample}{{{label_str}}} {value}")
+    if openmetrics:
+        lines.append("# EOF")
+    return "\n".join(lines) + "\n"
+
+
+def write_textfile(path : str, text : str):
+    """ Write the metrics atomically, so node-exporter never reads a partial file. """
+    tmp = f"{path}.{os.getpid()}.tmp"
+    with open(tmp, "w") as f:
+        f.write(text)
+    os.replace(tmp, path)
+
+
+def serve(collector : Collector, port : int, min_interval : float):
+    """ Serve the metrics on http://localhost:port/metrics.
+
+    Args:
+        collector (Collector): Metric collector.
+        port (int): Port to listen on.
+        min_interval (float): Scrapes closer together than this get the previous result.
+    """
+    cache = {"time" : None, "text" : None}
+
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            if self.path not in ["/", "/metrics"]:
+                self.send_error(404)
+                return
+            now = time.monotonic()
+            if cache["time"] is None or (now - cache["time"]) >= min_interval:
+                cache["text"] = render(collector.collect())
+                cache["time"] = now
+            body = cache["text"].encode("utf-8")
+            self.send_response(200)
+            self.send_header("Content-Type", "application/openmetrics-text; version=1.0.0; charset=utf-8")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            return
+
+    print(f"serving metrics on http://localhost:{port}/metrics")
+    HTTPServer(("localhost", port), Handler).serve_forever()
+
+
+def main(args : argparse.Namespace):
+    pinning = None
+    if args.pinning:
+        with open(args.pinning, "r") as f:
+            pinning = json.load(f)
+
+    collector = Collector(args.sysfs_root, args.procfs_root, pinning, args.diag_interval)
+
+    if args.port:
+        serve(collector, args.port, args.interval)
+    elif args.textfile:
+        print(f"writing metrics to {args.textfile} every {args.interval} s")
+        while True:
+            write_textfile(args.textfile, render(collector.collect(), openmetrics = False))
+            time.sleep(args.interval)
+    else:
+        time.sleep(min(args.interval, 1)) # so there is an interval to compute the cpu utilisation over
+        sys.stdout.write(render(collector.collect())) # not rich.print, it would wrap lines and interpret markup
+    return
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser("Export topology, diagnostics and pinning health as OpenMetrics.")
+    parser.add_argument("-p", "--pinning", type = str, help = "pinning file, used for the per thread type cpu utilisation and pinning diagnostics.")
+    parser.add_argument("--textfile", type = str, help = "node-exporter textfile to (re)write every interval.")
+    parser.add_argument("--port", type = int, help = "serve the metrics on this local port.")
+    parser.add_argument("-i", "--interval", type = float, default = 5, help = "seconds between two collections.")
+    parser.add_argument("--diag_interval", type = float, default = 60, help = "seconds between two evaluations of the diagnostics.")
+    parser.add_argument("--sysfs_root", type = str, default = "/sys", help = "sysfs mount point.")
+    parser.add_argument("--procfs_root", type = str, default = "/proc", help = "procfs mount point.")
+
+    args = parser.parse_args()
+    main(args)
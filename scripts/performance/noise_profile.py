@@ -0,0 +1,141 @@
+#!/usr/bin/env python
+"""
+Description: Profile the OS noise (jitter) seen by each CPU core.
+
+A tight timestamp loop is run on every candidate core, in parallel, each in a
+worker process pinned to that core. Any gap between two consecutive timestamps
+larger than the threshold is counted as an interruption (IRQ, kernel thread,
+timer tick, ...). The result is written as a json file with a noise score per
+core, which create_pinning_minimal.py can read (--noise_profile) to keep the
+latency critical threads (rawproc, rte-worker) off the noisiest cores.
+"""
+import argparse
+import gc
+import json
+import math
+import os
+import time
+
+from concurrent.futures import ProcessPoolExecutor
+from socket import gethostname
+
+from rich import print
+
+from create_pinning_minimal import str_to_cpu_list
+
+SHORT_DURATION = 0.5 # seconds per core when running as a pre-run check
+
+
+def percentile(values : list[int], q : float) -> int:
+    """ Nearest rank percentile of a list of values.
+
+    Args:
+        values (list[int]): Values, must be sorted.
+        q (float): Percentile, between 0 and 100.
+
+    Returns:
+        int: Value at the requested percentile, 0 if there are no values.
+    """
+    if len(values) == 0:
+        return 0
+    rank = max(0, min(len(values) - 1, math.ceil(q / 100 * len(values)) - 1))
+    return values[rank]
+
+
+def sample_core(cpu : int, duration : float, threshold_ns : int) -> dict:
+    """ Run the timestamp loop on a single core and summarise the interruption gaps.
+
+    Args:
+        cpu (int): CPU to pin this process to.
+        duration (float): Sampling time in seconds.
+        threshold_ns (int): Minimum gap in ns counted as an interruption.
+
+    Returns:
+        dict: Interruption statistics for the core.
+    """
+    os.sched_setaffinity(0, {cpu})
+    gc.disable() # garbage collection pauses would show up as noise
+
+    gaps = []
+    clock = time.perf_counter_ns
+    start = last = clock()
+    end = start + int(duration * 1e9)
+    while last < end:
+        now = clock()
+        if now - last > threshold_ns:
+            gaps.append(now - last)
+        last = now
+    gc.enable()
+
+    elapsed = last - start
+    gaps.sort()
+    lost = sum(gaps)
+    return {
+        "cpu" : cpu,
+        "duration_ns" : elapsed,
+        "count" : len(gaps),
+        "max_ns" : gaps[-1] if gaps else 0,
+        "p50_ns" : percentile(gaps, 50),
+        "p99_ns" : percentile(gaps, 99),
+        "p999_ns" : percentile(gaps, 99.9),
+        "lost_ns" : lost,
+        # time lost to interruptions, in us per second of sampling
+        "score" : lost / 1e3 / (elapsed / 1e9) if elapsed > 0 else 0,
+    }
+
+
+def profile_cores(cpus : list[int], duration : float, threshold_ns : int) -> dict[int, dict]:
+    """ Sample all the cores in parallel, one pinned worker process per core.
+
+    Args:
+        cpus (list[int]): CPUs to profile.
+        duration (float): Sampling time per core in seconds.
+        threshold_ns (int): Minimum gap in ns counted as an interruption.
+
+    Returns:
+        dict[int, dict]: Interruption statistics per core.
+    """
+    with ProcessPoolExecutor(max_workers = len(cpus)) as pool:
+        results = pool.map(sample_core, cpus, [duration] * len(cpus), [threshold_ns] * len(cpus))
+        return {r["cpu"] : r for r in results}
+
+
+def main(args : argparse.Namespace):
+    if args.cpus:
+        cpus = str_to_cpu_list(args.cpus)
+    else:
+        cpus = sorted(os.sched_getaffinity(0))
+
+    duration = SHORT_DURATION if args.short else args.duration
+    print(f"profiling {len(cpus)} cpus for {duration} s each (threshold {args.threshold} ns)")
+
+    cores = profile_cores(cpus, duration, args.threshold)
+
+    ranked = sorted(cores.values(), key = lambda r : r["score"], reverse = True)
+    print("noisiest cpus:")
+    for r in ranked[:args.top]:
+        print(f"  -> cpu {r['cpu']}: score {r['score']:.1f} us/s, {r['count']} gaps, max {r['max_ns'] / 1e3:.1f} us, p99 {r['p99_ns'] / 1e3:.1f} us")
+
+    profile = {
+        "host" : gethostname(),
+        "duration" : duration,
+        "threshold_ns" : args.threshold,
+        "cores" : {str(c) : r for c, r in sorted(cores.items())},
+    }
+    with open(args.output, "w") as f:
+        json.dump(profile, f, indent = 4)
+    print(f"noise profile has been written to {args.output}")
+    return
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser("Measure the OS noise on each cpu core.")
+    parser.add_argument("-c", "--cpus", type = str, help = "cpus to profile e.g. 1-31,33-63, defaults to all cpus this process may run on.")
+    parser.add_argument("-d", "--duration", type = float, default = 5, help = "sampling time per core in seconds.")
+    parser.add_argument("-s", "--short", action = "store_true", help = f"short pre-run check, samples each core for {SHORT_DURATION} s.")
+    parser.add_argument("--threshold", type = int, default = 5000, help = "minimum gap between timestamps (ns) counted as an interruption.")
+    parser.add_argument("--top", type = int, default = 8, help = "number of noisiest cpus to print.")
+    parser.add_argument("-o", "--output", type = str, default = "noise-profile.json", help = "output json file.")
+
+    args = parser.parse_args()
+    main(args)
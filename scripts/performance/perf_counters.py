@@ -0,0 +1,256 @@
+#!/usr/bin/env python
+"""
+Description: Sample hardware performance counters of the pinned threads, per thread type.
+
+The threads of the daq applications in a pinning file are found in /proc (the process
+command line contains the application name, the thread name matches the thread entry
+of the pinning file), and their counters are sampled for a few seconds:
+
+    IPC           : instructions per cycle.
+    LLC MPKI      : last level cache load misses per 1000 instructions.
+    remote ratio  : fraction of the node loads served by a remote NUMA node.
+
+The results are aggregated per thread type and per application and compared with
+the placement: a thread type with a high remote ratio, or pinned to cpus of more than
+one NUMA node, is flagged.
+
+The counters are read through a backend. The default one runs `perf stat` (which uses
+perf_event_open) on the thread ids; a FakeBackend returning fixed counts (--fake) lets
+the aggregation be tried without a running DAQ or root access.
+"""
+import argparse
+import json
+import os
+import re
+import subprocess
+
+from rich import print
+from rich.table import Table
+
+from create_pinning_minimal import str_to_cpu_list, thread_role
+from host_info import read_value
+
+EVENTS = ["instructions", "cycles", "LLC-load-misses", "node-loads", "node-load-misses"]
+
+
+class PerfStatBackend:
+    """
+    Read the counters of threads with `perf stat`.
+
+    Attributes
+    ----------
+    events : list[str]
+        perf events to count.
+    """
+    def __init__(self, events : list[str] = EVENTS) -> None:
+        self.events = events
+        pass
+
+
+    def sample(self, tids : list[int], duration : float) -> dict[int, dict[str, int]]:
+        """ Count the events of each thread for a while.
+
+        Args:
+            tids (list[int]): Thread ids.
+            duration (float): Sampling time in seconds.
+
+        Returns:
+            dict[int, dict[str, int]]: Count per event per thread, None for events that could not be counted.
+        """
+        cmd = ["perf", "stat", "-x", ",", "--per-thread", "-e", ",".join(self.events), "-t", ",".join(str(t) for t in tids), "--", "sleep", str(duration)]
+        try:
+            out = subprocess.run(cmd, capture_output = True, text = True)
+        except FileNotFoundError:
+            raise Exception("perf was not found, install it (e.g. the perf or linux-tools package) or use --fake")
+        counts = parse_perf_stat(out.stderr) # perf stat writes the counts to stderr
+        if not counts:
+            raise Exception(f"perf stat failed: {out.stderr.strip()}")
+        return counts
+
+
+def parse_perf_stat(output : str) -> dict[int, dict[str, int]]:
+    """ Parse the output of `perf stat -x, --per-thread`.
+
+    Args:
+        output (str): Lines of "<comm>-<tid>,<count>,<unit>,<event>,...", other lines are skipped.
+
+    Returns:
+        dict[int, dict[str, int]]: Count per event per thread, None for events that could not be counted.
+    """
+    counts = {}
+    for line in output.splitlines():
+        fields = line.split(",")
+        if len(fields) < 4 or "-" not in fields[0]:
+            continue
+        try:
+            tid = int(fields[0].rsplit("-", 1)[1]) # thread names can contain "-"
+        except ValueError:
+            continue
+        value = int(fields[1]) if fields[1].isdigit() else None # e.g. <not counted>
+        counts.setdefault(tid, {})[fields[3]] = value
+    return counts
+
+
+class FakeBackend:
+    """
+    Return fixed counts, for testing.
+
+    Attributes
+    ----------
+    counts : dict[int, dict[str, int]]
+        Count per event per thread id.
+    """
+    def __init__(self, counts : dict[int, dict[str, int]]) -> None:
+        self.counts = counts
+        pass
+
+
+    def sample(self, tids : list[int], duration : float) -> dict[int, dict[str, int]]:
+        """ Counts of the requested threads, the duration is ignored. """
+        return {t : self.counts[t] for t in tids if t in self.counts}
+
+
+def find_threads(pinning : dict, procfs_root : str = "/proc") -> list[dict]:
+    """ Find the running threads of the daq applications in a pinning file.
+
+    Args:
+        pinning (dict): Pinning configuration.
+        procfs_root (str, optional): procfs mount point. Defaults to "/proc".
+
+    Returns:
+        list[dict]: Application, thread type, thread id, name and pinned cpus of each thread.
+    """
+    threads = []
+    pids = [p for p in os.listdir(procfs_root) if p.isdigit()]
+    for app, config in pinning["daq_application"].items():
+        app_name = app.replace("--name ", "")
+        for pid in pids:
+            cmdline = (read_value(os.path.join(procfs_root, pid, "cmdline")) or "").split("\0")
+            if app_name not in cmdline:
+                continue
+            task_dir = os.path.join(procfs_root, pid, "task")
+            try:
+                tids = sorted(os.listdir(task_dir), key = int)
+            except (FileNotFoundError, ProcessLookupError):
+                continue # the process exited during the scan
+            for tid in tids:
+                comm = read_value(os.path.join(task_dir, tid, "comm"))
+                if comm is None:
+                    continue # the thread exited during the scan
+                thread = next((t for t in config.get("threads", {}) if re.match(t, comm)), None)
+                if thread is not None:
+                    role, cpus = thread_role(thread), config["threads"][thread]
+                else:
+                    role, cpus = "parent", config.get("parent")
+                threads.append({"app" : app_name, "role" : role, "tid" : int(tid), "comm" : comm, "cpus" : str_to_cpu_list(cpus or "")})
+    return threads
+
+
+def numa_of_cpus(sysfs_root : str) -> dict[int, int]:
+    """ NUMA node of each cpu. """
+    node_dir = os.path.join(sysfs_root, "devices", "system", "node")
+    cpu_node = {}
+    if os.path.isdir(node_dir):
+        for node in os.listdir(node_dir):
+            if node.startswith("node") and node[4:].isdigit():
+                for c in str_to_cpu_list(read_value(os.path.join(node_dir, node, "cpulist")) or ""):
+                    cpu_node[c] = int(node[4:])
+    return cpu_node
+
+
+def derived(counts : dict[str, int]) -> dict[str, float]:
+    """ IPC, LLC misses per 1000 instructions and remote access ratio from raw counts. """
+    def get(e):
+        return counts.get(e) or 0
+    return {
+        "ipc" : get("instructions") / get("cycles") if get("cycles") else None,
+        "llc_mpki" : 1000 * get("LLC-load-misses") / get("instructions") if get("instructions") else None,
+        "remote_ratio" : get("node-load-misses") / get("node-loads") if get("node-loads") else None,
+    }
+
+
+def aggregate(threads : list[dict], counts : dict[int, dict[str, int]], cpu_node : dict[int, int], remote_threshold : float) -> list[dict]:
+    """ Sum the counts per application and thread type and compare with the placement.
+
+    Args:
+        threads (list[dict]): Threads from find_threads.
+        counts (dict[int, dict[str, int]]): Count per event per thread id.
+        cpu_node (dict[int, int]): NUMA node of each cpu.
+        remote_threshold (float): Remote access ratio above which a thread type is flagged.
+
+    Returns:
+        list[dict]: Per application and thread type: summed counts, derived metrics, pinned NUMA nodes and flags.
+    """
+    groups = {}
+    for t in threads:
+        if t["tid"] not in counts:
+            continue
+        g = groups.setdefault((t["app"], t["role"]), {"app" : t["app"], "role" : t["role"], "threads" : 0, "counts" : {}, "nodes" : set()})
+        g["threads"] += 1
+        for e, v in counts[t["tid"]].items():
+            g["counts"][e] = g["counts"].get(e, 0) + (v or 0)
+        g["nodes"].update(cpu_node[c] for c in t["cpus"] if c in cpu_node)
+
+    results = []
+    for g in groups.values():
+        g.update(derived(g["counts"]))
+        g["nodes"] = sorted(g["nodes"])
+        g["flags"] = []
+        if len(g["nodes"]) > 1:
+            g["flags"].append(f"pinned to cpus of numa nodes {g['nodes']}")
+        if g["remote_ratio"] is not None and g["remote_ratio"] > remote_threshold:
+            g["flags"].append(f"{g['remote_ratio']:.0%} of node loads are remote, memory is not local to numa node {g['nodes']}")
+        results.append(g)
+    return sorted(results, key = lambda g : (g["app"], g["role"]))
+
+
+def main(args : argparse.Namespace):
+    with open(args.pinning, "r") as f:
+        pinning = json.load(f)
+
+    threads = find_threads(pinning, args.procfs_root)
+    if len(threads) == 0:
+        print("[red]no running threads of the daq applications in the pinning file were found[/red]")
+        return
+    print(f"found {len(threads)} threads")
+
+    if args.fake:
+        with open(args.fake, "r") as f:
+            backend = FakeBackend({int(k) : v for k, v in json.load(f).items()})
+    else:
+        backend = PerfStatBackend()
+
+    counts = backend.sample([t["tid"] for t in threads], args.duration)
+    results = aggregate(threads, counts, numa_of_cpus(args.sysfs_root), args.remote_threshold)
+
+    table = Table(title = "performance counters per thread type")
+    for col in ["application", "thread type", "threads", "IPC", "LLC MPKI", "remote ratio", "numa"]:
+        table.add_column(col)
+    fmt = lambda v, f : f.format(v) if v is not None else "-"
+    for r in results:
+        table.add_row(r["app"], r["role"], str(r["threads"]), fmt(r["ipc"], "{:.2f}"), fmt(r["llc_mpki"], "{:.2f}"), fmt(r["remote_ratio"], "{:.1%}"), ",".join(str(n) for n in r["nodes"]))
+    print(table)
+
+    for r in results:
+        for flag in r["flags"]:
+            print(f"[yellow]WARNING: {r['app']} {r['role']}: {flag}[/yellow]")
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent = 4)
+        print(f"results have been written to {args.output}")
+    return
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser("Sample hardware performance counters of the pinned threads.")
+    parser.add_argument("-p", "--pinning", type = str, required = True, help = "pinning file of the running daq applications.")
+    parser.add_argument("-d", "--duration", type = float, default = 5, help = "sampling time in seconds.")
+    parser.add_argument("--remote_threshold", type = float, default = 0.2, help = "remote access ratio above which a thread type is flagged.")
+    parser.add_argument("--fake", type = str, help = "json file with counts per thread id, used instead of perf.")
+    parser.add_argument("--sysfs_root", type = str, default = "/sys", help = "sysfs mount point.")
+    parser.add_argument("--procfs_root", type = str, default = "/proc", help = "procfs mount point.")
+    parser.add_argument("-o", "--output", type = str, help = "json file to write the results to.")
+
+    args = parser.parse_args()
+    main(args)
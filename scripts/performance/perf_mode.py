@@ -0,0 +1,274 @@
+#!/usr/bin/env python
+"""
+Description: Put the cores of a pinning file into performance mode, check it, and undo it.
+
+Frequency dips on pinned cores are a known cause of rate drops, so for readout the
+cores in the pinning file should run with the performance governor and energy
+performance preference, turbo/boost enabled and deep C-states disabled. All settings
+are read and written through sysfs (cpufreq, cpuidle), with a configurable root so
+the script can be tried on a copy of the sysfs tree.
+
+    capture : save the current power settings of the pinned cores to the state file.
+    apply   : capture, then apply the readout profile to the pinned cores and verify it.
+    verify  : check that the pinned cores are in the readout profile.
+    restore : write back the settings saved in the state file.
+"""
+import argparse
+import json
+import os
+import sys
+
+from rich import print
+
+from create_pinning_minimal import pinned_cpus, str_to_cpu_list
+from host_info import read_value, write_value
+
+CPU_DIR = "devices/system/cpu"
+
+
+class PowerControl:
+    """
+    Access to the cpufreq and cpuidle settings of a set of CPUs.
+
+    Attributes
+    ----------
+    root : str
+        sysfs mount point, /sys on a real host.
+    cpus : list[int]
+        CPUs to control.
+    """
+    def __init__(self, root : str, cpus : list[int]) -> None:
+        self.root = root
+        self.cpus = sorted(cpus)
+        pass
+
+
+    def cpu_path(self, cpu : int, *parts : str) -> str:
+        """ Path of a per-CPU sysfs attribute. """
+        return os.path.join(self.root, CPU_DIR, f"cpu{cpu}", *parts)
+
+
+    def boost_path(self) -> tuple[str, bool]:
+        """ Locate the global turbo/boost switch.
+
+        Returns:
+            tuple[str, bool]: Path of the switch and whether its meaning is inverted (intel_pstate no_turbo), None if there is no switch.
+        """
+        no_turbo = os.path.join(self.root, CPU_DIR, "intel_pstate", "no_turbo")
+        if os.path.exists(no_turbo):
+            return no_turbo, True
+        boost = os.path.join(self.root, CPU_DIR, "cpufreq", "boost")
+        if os.path.exists(boost):
+            return boost, False
+        return None, False
+
+
+    def idle_states(self, cpu : int) -> list[str]:
+        """ Names of the cpuidle states of a CPU (state0, state1, ...). """
+        cpuidle = self.cpu_path(cpu, "cpuidle")
+        if not os.path.isdir(cpuidle):
+            return []
+        return sorted((s for s in os.listdir(cpuidle) if s.startswith("state")), key = lambda s : int(s[5:]))
+
+
+    def capture(self) -> dict:
+        """ Read the current power settings.
+
+        Returns:
+            dict: Power settings, in the format expected by restore.
+        """
+        state = {"boost" : None, "cpus" : {}}
+        boost, _ = self.boost_path()
+        if boost:
+            state["boost"] = {"path" : os.path.relpath(boost, self.root), "value" : read_value(boost)}
+
+        for cpu in self.cpus:
+            cpu_state = {
+                "governor" : read_value(self.cpu_path(cpu, "cpufreq", "scaling_governor")),
+                "epp" : read_value(self.cpu_path(cpu, "cpufreq", "energy_performance_preference")),
+                "min_freq" : read_value(self.cpu_path(cpu, "cpufreq", "scaling_min_freq")),
+                "cstates" : {},
+            }
+            for s in self.idle_states(cpu):
+                cpu_state["cstates"][s] = read_value(self.cpu_path(cpu, "cpuidle", s, "disable"))
+            state["cpus"][str(cpu)] = cpu_state
+        return state
+
+
+    def expected(self, profile : dict) -> dict:
+        """ Settings the readout profile should result in, per attribute path.
+
+        Args:
+            profile (dict): Readout profile.
+
+        Returns:
+            dict: Expected value of each sysfs attribute.
+        """
+        settings = {}
+        boost, inverted = self.boost_path()
+        if boost and profile["boost"] is not None:
+            settings[boost] = str(int(profile["boost"] != inverted))
+
+        for cpu in self.cpus:
+            if os.path.exists(self.cpu_path(cpu, "cpufreq", "scaling_governor")):
+                settings[self.cpu_path(cpu, "cpufreq", "scaling_governor")] = profile["governor"]
+            if os.path.exists(self.cpu_path(cpu, "cpufreq", "energy_performance_preference")):
+                settings[self.cpu_path(cpu, "cpufreq", "energy_performance_preference")] = profile["epp"]
+            if profile["lock_freq"]:
+                max_freq = read_value(self.cpu_path(cpu, "cpufreq", "cpuinfo_max_freq"))
+                if max_freq is not None:
+                    settings[self.cpu_path(cpu, "cpufreq", "scaling_min_freq")] = max_freq
+            for s in self.idle_states(cpu):
+                latency = read_value(self.cpu_path(cpu, "cpuidle", s, "latency"))
+                if latency is None:
+                    continue
+                # state0 is the polling state, never disable it
+                disable = s != "state0" and int(latency) > profile["max_latency"]
+                settings[self.cpu_path(cpu, "cpuidle", s, "disable")] = str(int(disable))
+        return settings
+
+
+    def apply(self, profile : dict) -> list[str]:
+        """ Apply the readout profile.
+
+        Args:
+            profile (dict): Readout profile.
+
+        Returns:
+            list[str]: Errors, one per attribute that could not be written.
+        """
+        errors = []
+        for path, value in self.expected(profile).items():
+            try:
+                write_value(path, value)
+            except OSError as err:
+                errors.append(f"could not write {value} to {path}: {err}")
+        return errors
+
+
+    def verify(self, profile : dict) -> list[str]:
+        """ Compare the current settings with the readout profile.
+
+        Args:
+            profile (dict): Readout profile.
+
+        Returns:
+            list[str]: Mismatches, empty if all pinned cores are in the readout profile.
+        """
+        mismatches = []
+        for path, value in self.expected(profile).items():
+            current = read_value(path)
+            if current != value:
+                mismatches.append(f"{os.path.relpath(path, self.root)} is {current}, expected {value}")
+        return mismatches
+
+
+    def restore(self, state : dict) -> list[str]:
+        """ Write back settings saved by capture.
+
+        Args:
+            state (dict): Saved power settings.
+
+        Returns:
+            list[str]: Errors, one per attribute that could not be written.
+        """
+        settings = {}
+        if state["boost"] is not None:
+            settings[os.path.join(self.root, state["boost"]["path"])] = state["boost"]["value"]
+        for cpu, cpu_state in state["cpus"].items():
+            cpu = int(cpu)
+            for key, attr in [("governor", "scaling_governor"), ("epp", "energy_performance_preference"), ("min_freq", "scaling_min_freq")]:
+                if cpu_state[key] is not None:
+                    settings[self.cpu_path(cpu, "cpufreq", attr)] = cpu_state[key]
+            for s, disable in cpu_state["cstates"].items():
+                if disable is not None:
+                    settings[self.cpu_path(cpu, "cpuidle", s, "disable")] = disable
+
+        errors = []
+        for path, value in settings.items():
+            try:
+                write_value(path, value)
+            except OSError as err:
+                errors.append(f"could not write {value} to {path}: {err}")
+        return errors
+
+
+def report(title : str, lines : list[str]) -> bool:
+    """ Print the outcome of a step, return True if there were no problems. """
+    if len(lines) == 0:
+        print(f"{title}: [green]OK[/green]")
+        return True
+    print(f"{title}: [red]{len(lines)} problem(s)[/red]")
+    for l in lines:
+        print("  ->", l)
+    return False
+
+
+def main(args : argparse.Namespace):
+    if args.action == "restore":
+        with open(args.state, "r") as f:
+            state = json.load(f)
+        control = PowerControl(args.sysfs_root, [int(c) for c in state["cpus"]])
+        ok = report("restore", control.restore(state))
+        if ok:
+            os.remove(args.state) # the next apply captures the settings again
+        return ok
+
+    if args.pinning:
+        with open(args.pinning, "r") as f:
+            cpus = sorted(pinned_cpus(json.load(f)))
+    elif args.cpus:
+        cpus = str_to_cpu_list(args.cpus)
+    else:
+        raise Exception("a pinning file (--pinning) or cpu list (--cpus) is required")
+
+    control = PowerControl(args.sysfs_root, cpus)
+    profile = {
+        "governor" : args.governor,
+        "epp" : args.epp,
+        "boost" : not args.no_boost,
+        "max_latency" : args.max_latency,
+        "lock_freq" : args.lock_freq,
+    }
+    print(f"cpus: {cpus}")
+
+    ok = True
+    # never replace the saved original settings with the readout profile, e.g. by applying twice
+    if args.action in ["capture", "apply"]:
+        if os.path.exists(args.state) and not args.force:
+            with open(args.state, "r") as f:
+                saved = [int(c) for c in json.load(f)["cpus"]]
+            if args.action == "capture":
+                raise Exception(f"{args.state} already exists, restore it first or use --force to overwrite it")
+            if sorted(saved) != sorted(cpus):
+                raise Exception(f"{args.state} holds the settings of cpus {saved}, not {cpus}, restore it first or use --force to overwrite it")
+            print(f"power settings saved in {args.state} are kept")
+        else:
+            with open(args.state, "w") as f:
+                json.dump(control.capture(), f, indent = 4)
+            print(f"power settings have been saved to {args.state}")
+
+    if args.action == "apply":
+        ok = report("apply", control.apply(profile))
+
+    if args.action in ["apply", "verify"]:
+        ok = report("verify", control.verify(profile)) and ok
+    return ok
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser("Control the cpu frequency and C-state settings of pinned cores.")
+    parser.add_argument("action", choices = ["capture", "apply", "verify", "restore"], help = "what to do.")
+    parser.add_argument("-p", "--pinning", type = str, help = "pinning file, the cores it uses are controlled.")
+    parser.add_argument("-c", "--cpus", type = str, help = "cpus to control instead of a pinning file e.g. 1-31,33-63.")
+    parser.add_argument("-s", "--state", type = str, default = "perf-mode-state.json", help = "file the power settings are saved to / restored from.")
+    parser.add_argument("-f", "--force", action = "store_true", help = "overwrite an existing state file when capturing or applying.")
+    parser.add_argument("--sysfs_root", type = str, default = "/sys", help = "sysfs mount point.")
+    parser.add_argument("--governor", type = str, default = "performance", help = "cpufreq governor of the readout profile.")
+    parser.add_argument("--epp", type = str, default = "performance", help = "energy performance preference of the readout profile.")
+    parser.add_argument("--no_boost", action = "store_true", help = "disable turbo/boost instead of enabling it.")
+    parser.add_argument("--max_latency", type = int, default = 2, help = "disable C-states with an exit latency (us) above this.")
+    parser.add_argument("--lock_freq", action = "store_true", help = "also raise the minimum frequency to the maximum.")
+
+    args = parser.parse_args()
+    sys.exit(0 if main(args) else 1)
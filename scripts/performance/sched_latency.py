@@ -0,0 +1,302 @@
+#!/usr/bin/env python
+"""
+Description: Scheduler wakeup latency and preemption histograms for the pinned threads.
+
+sched_wakeup and sched_switch events are read either live from tracefs or from a saved
+trace file in the tracefs text format,
+e.g. recorded with `cat /sys/kernel/tracing/trace_pipe > sched.trace`. Replaying a file
+needs no root, so the analysis can be done offline.
+
+The threads of interest are the ones whose name matches a thread entry of the pinning
+file. The events are streamed through a generator pipeline (read -> parse -> filter ->
+analyse) into fixed size log2 histograms, so the memory used does not grow with the
+length of the trace:
+
+    wakeup latency : time from sched_wakeup of the thread to it being switched in.
+    preemption     : time from the thread being switched out while still runnable to it
+                     being switched back in, attributed to the task that displaced it.
+"""
+import argparse
+import json
+import os
+import re
+import select
+import time
+
+from rich import print
+from rich.table import Table
+
+from create_pinning_minimal import pinned_cpus, thread_role
+
+N_BUCKETS = 32 # log2 buckets of 1 us, 2 us, 4 us, ... ~1 h
+MAX_DISPLACERS = 16 # tasks kept per thread in the preemption attribution, the rest are summed as "other"
+
+EVENT_RE = re.compile(r"^\s*(?P<task>.+?)-(?P<pid>\d+)\s+(?:\(.*?\)\s+)?\[(?P<cpu>\d+)\]\s+(?:\S+\s+)?(?P<ts>\d+\.\d+):\s+(?P<event>sched_wakeup|sched_wakeup_new|sched_switch):\s+(?P<args>.*)$")
+FIELD_RE = re.compile(r"(\w+)=(\S+)")
+
+
+class Histogram:
+    """
+    Fixed size histogram with log2 buckets in us.
+
+    Attributes
+    ----------
+    buckets : list[int]
+        Counts, bucket i holds values in [2^i, 2^(i+1)) us (bucket 0 also holds values below 1 us).
+    count : int
+        Number of values.
+    total : float
+        Sum of the values (us).
+    max : float
+        Largest value (us).
+    """
+    def __init__(self) -> None:
+        self.buckets = [0] * N_BUCKETS
+        self.count = 0
+        self.total = 0.
+        self.max = 0.
+        pass
+
+
+    def add(self, value : float):
+        """ Add a value in us. """
+        i = min(N_BUCKETS - 1, max(0, int(value).bit_length() - 1))
+        self.buckets[i] += 1
+        self.count += 1
+        self.total += value
+        self.max = max(self.max, value)
+
+
+    def percentile(self, q : float) -> float:
+        """ Upper edge of the bucket holding the q-th percentile, in us. """
+        if self.count == 0:
+            return 0.
+        target = q / 100 * self.count
+        seen = 0
+        for i, n in enumerate(self.buckets):
+            seen += n
+            if seen >= target:
+                return min(float(2 ** (i + 1)), self.max)
+        return self.max
+
+
+    def to_dict(self) -> dict:
+        return {"count" : self.count, "total_us" : self.total, "max_us" : self.max, "p50_us" : self.percentile(50), "p99_us" : self.percentile(99), "buckets" : self.buckets}
+
+
+class ThreadStats:
+    """
+    Scheduling statistics of one thread.
+
+    Attributes
+    ----------
+    comm : str
+        Thread name.
+    role : str
+        Thread type.
+    wakeup : Histogram
+        Wakeup latency.
+    preemption : Histogram
+        Time spent preempted.
+    displacers : dict[str, list]
+        Number of preemptions and preempted time (us) per displacing task.
+    """
+    def __init__(self, comm : str, role : str) -> None:
+        self.comm = comm
+        self.role = role
+        self.wakeup = Histogram()
+        self.preemption = Histogram()
+        self.displacers = {}
+        pass
+
+
+    def add_preemption(self, displacer : str, value : float):
+        """ Record a preemption of value us by the displacer task. """
+        self.preemption.add(value)
+        if (displacer not in self.displacers) and (len(self.displacers) >= MAX_DISPLACERS):
+            displacer = "other"
+        entry = self.displacers.setdefault(displacer, [0, 0.])
+        entry[0] += 1
+        entry[1] += value
+
+
+def read_trace_file(path : str):
+    """ Yield the lines of a saved trace file. """
+    with open(path, "r") as f:
+        for line in f:
+            yield line
+
+
+def read_tracefs(tracefs_root : str, duration : float, save : str = None):
+    """ Enable the sched_wakeup/sched_switch events and yield the lines of trace_pipe for a while.
+
+    All cpus are traced: a wakeup is recorded on the cpu of the waker, which is usually not a pinned one.
+
+    Args:
+        tracefs_root (str): tracefs mount point.
+        duration (float): Tracing time in seconds.
+        save (str, optional): File to also write the raw trace to. Defaults to None.
+
+    Yields:
+        str: Trace lines.
+    """
+    def write(rel, value):
+        with open(os.path.join(tracefs_root, rel), "w") as f:
+            f.write(value)
+
+    def read(rel):
+        with open(os.path.join(tracefs_root, rel), "r") as f:
+            return f.read().strip()
+
+    events = ["events/sched/sched_wakeup/enable", "events/sched/sched_switch/enable"]
+    saved = {rel : read(rel) for rel in events}
+    out = open(save, "w") if save else None
+    try:
+        for rel in events:
+            write(rel, "1")
+        end = time.monotonic() + duration
+        # unbuffered, so that select sees all the data not read yet, the lines are split here
+        pipe = os.open(os.path.join(tracefs_root, "trace_pipe"), os.O_RDONLY | os.O_NONBLOCK)
+        pending = b""
+        try:
+            while time.monotonic() < end:
+                ready, _, _ = select.select([pipe], [], [], max(0, min(0.5, end - time.monotonic())))
+                if not ready:
+                    continue
+                try:
+                    chunk = os.read(pipe, 65536)
+                except BlockingIOError:
+                    continue
+                if not chunk:
+                    time.sleep(0.01) # nothing new, e.g. end of a regular file
+                    continue
+                *lines, pending = (pending + chunk).split(b"\n")
+                for line in lines:
+                    line = line.decode("utf-8", "replace") + "\n"
+                    if out:
+                        out.write(line)
+                    yield line
+        finally:
+            os.close(pipe)
+    finally:
+        for rel, value in saved.items():
+            write(rel, value)
+        if out:
+            out.close()
+
+
+def parse_events(lines):
+    """ Parse trace lines into events, other lines are skipped.
+
+    Yields:
+        dict: Timestamp (us), cpu, event name and event fields.
+    """
+    for line in lines:
+        m = EVENT_RE.match(line)
+        if m is None:
+            continue
+        yield {"ts" : float(m.group("ts")) * 1e6, "cpu" : int(m.group("cpu")), "event" : m.group("event"), "fields" : dict(FIELD_RE.findall(m.group("args")))}
+
+
+def filter_cpus(events, cpus : set[int]):
+    """ Keep the switches that happened on, and the wakeups that target, the given cpus (all if cpus is empty). """
+    for e in events:
+        cpu = int(e["fields"].get("target_cpu", e["cpu"])) if e["event"] != "sched_switch" else e["cpu"]
+        if (not cpus) or (cpu in cpus):
+            yield e
+
+
+def analyse(events, match : callable) -> dict[tuple[str, int], ThreadStats]:
+    """ Accumulate the wakeup latency and preemption histograms of the matched threads.
+
+    Args:
+        events (iterable): Parsed events.
+        match (callable): Returns the thread type for a thread name, None if the thread is not of interest.
+
+    Returns:
+        dict[tuple[str, int], ThreadStats]: Statistics per thread (name, pid).
+    """
+    stats = {}
+    woken = {} # pid -> wakeup time
+    preempted = {} # pid -> (switch out time, displacing task)
+    roles = {} # thread name -> thread type, None if not of interest
+
+    def tracked(comm : str, pid : int) -> ThreadStats | None:
+        if comm not in roles:
+            roles[comm] = match(comm)
+        if roles[comm] is None:
+            return None
+        return stats.setdefault((comm, pid), ThreadStats(comm, roles[comm]))
+
+    for e in events:
+        f = e["fields"]
+        if e["event"] in ["sched_wakeup", "sched_wakeup_new"]:
+            pid = int(f.get("pid", -1))
+            if tracked(f.get("comm", ""), pid) is not None:
+                woken[pid] = e["ts"]
+        else: # sched_switch
+            prev_pid, next_pid = int(f.get("prev_pid", -1)), int(f.get("next_pid", -1))
+            prev = tracked(f.get("prev_comm", ""), prev_pid)
+            if prev is not None and f.get("prev_state", "").startswith("R"):
+                preempted[prev_pid] = (e["ts"], f.get("next_comm", ""))
+
+            nxt = tracked(f.get("next_comm", ""), next_pid)
+            if nxt is not None:
+                if next_pid in woken:
+                    nxt.wakeup.add(e["ts"] - woken.pop(next_pid))
+                if next_pid in preempted:
+                    t0, displacer = preempted.pop(next_pid)
+                    nxt.add_preemption(displacer, e["ts"] - t0)
+    return stats
+
+
+def pinning_matcher(pinning : dict) -> callable:
+    """ Matcher of the thread names of a pinning file to their thread type. """
+    patterns = [(re.compile(t), thread_role(t)) for app in pinning["daq_application"].values() for t in app.get("threads", {})]
+    def match(comm : str) -> str | None:
+        return next((role for p, role in patterns if p.match(comm)), None)
+    return match
+
+
+def main(args : argparse.Namespace):
+    with open(args.pinning, "r") as f:
+        pinning = json.load(f)
+    cpus = pinned_cpus(pinning)
+
+    if args.trace:
+        lines = read_trace_file(args.trace)
+    else:
+        lines = read_tracefs(args.tracefs_root, args.duration, args.save)
+        print(f"tracing for {args.duration} s")
+
+    stats = analyse(filter_cpus(parse_events(lines), cpus), pinning_matcher(pinning))
+
+    table = Table(title = "wakeup latency and preemption per thread (us)")
+    for col in ["thread", "type", "wakeups", "p50", "p99", "max", "preemptions", "preempted", "top displacers"]:
+        table.add_column(col)
+    for (comm, pid), s in sorted(stats.items(), key = lambda kv : (kv[1].role, kv[0])):
+        top = sorted(s.displacers.items(), key = lambda kv : kv[1][1], reverse = True)[:3]
+        table.add_row(f"{comm} ({pid})", s.role, str(s.wakeup.count), f"{s.wakeup.percentile(50):.0f}", f"{s.wakeup.percentile(99):.0f}", f"{s.wakeup.max:.0f}",
+                      str(s.preemption.count), f"{s.preemption.total:.0f}", ", ".join(f"{d} ({v[0]})" for d, v in top))
+    print(table)
+
+    if args.output:
+        results = [{"comm" : comm, "pid" : pid, "role" : s.role, "wakeup" : s.wakeup.to_dict(), "preemption" : s.preemption.to_dict(),
+                    "displacers" : {d : {"count" : v[0], "total_us" : v[1]} for d, v in s.displacers.items()}} for (comm, pid), s in stats.items()]
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent = 4)
+        print(f"histograms have been written to {args.output}")
+    return
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser("Wakeup latency and preemption histograms of the pinned threads.")
+    parser.add_argument("-p", "--pinning", type = str, required = True, help = "pinning file, its threads and cpus are analysed.")
+    parser.add_argument("-t", "--trace", type = str, help = "saved trace file (tracefs text format) to replay instead of tracing live.")
+    parser.add_argument("-d", "--duration", type = float, default = 10, help = "live tracing time in seconds.")
+    parser.add_argument("--save", type = str, help = "also save the live trace to this file, for later replay.")
+    parser.add_argument("--tracefs_root", type = str, default = "/sys/kernel/tracing", help = "tracefs mount point.")
+    parser.add_argument("-o", "--output", type = str, help = "json file to write the histograms to.")
+
+    args = parser.parse_args()
+    main(args)
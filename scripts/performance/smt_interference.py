@@ -0,0 +1,237 @@
+#!/usr/bin/env python
+"""
+Description: Measure how much the readout thread types slow each other down when they share a physical core.
+
+Synthetic kernels stand in for the thread types:
+
+    stream  : NumPy streaming triad over arrays larger than the cache.
+    memcpy  : large buffer copies, like rawproc.
+    compute : in-cache floating point work, like tpproc.
+    syscall : small writes and fsyncs to a file, like recording.
+
+Each kernel is first run alone on a core, then every pair of kernels is run at the same
+time on two SMT siblings (same physical core) and on two separate physical cores. The
+throughput loss of a kernel is 1 - paired / alone. The output is a compatibility matrix
+between thread types, which create_pinning_minimal.py can read (--smt_matrix) to check
+which thread types end up as SMT neighbours.
+"""
+import argparse
+import itertools
+import json
+import os
+import tempfile
+import time
+
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+from rich import print
+from rich.table import Table
+
+from create_pinning_minimal import THREAD_ROLES
+
+STREAM_SIZE = 8 * 1024 * 1024 # float64 elements, 64 MiB per array
+MEMCPY_SIZE = 64 * 1024 * 1024 # bytes
+COMPUTE_SIZE = 64 # matrix dimension, fits in L1/L2
+SYSCALL_SIZE = 4096 # bytes per write
+
+# kernel representing each thread type
+ROLE_KERNELS = {
+    "rte-worker" : "memcpy",
+    "rawproc" : "memcpy",
+    "tpproc" : "compute",
+    "cleanup" : "stream",
+    "consumer" : "stream",
+    "periodic" : "compute",
+    "recording" : "syscall",
+}
+
+
+def kernel_stream(duration : float) -> float:
+    """ Streaming triad a = b + 2c through a preallocated scratch array, returns bytes/s.
+
+    Each iteration moves 5 arrays: read c, write tmp, read b and tmp, write a.
+    """
+    a, b, c = np.zeros(STREAM_SIZE), np.ones(STREAM_SIZE), np.ones(STREAM_SIZE)
+    tmp = np.empty(STREAM_SIZE) # no allocation in the loop
+    n = 0
+    end = time.perf_counter() + duration
+    while time.perf_counter() < end:
+        np.multiply(c, 2.0, out = tmp)
+        np.add(b, tmp, out = a)
+        n += 1
+    return n * 5 * STREAM_SIZE * 8 / duration
+
+
+def kernel_memcpy(duration : float) -> float:
+    """ Large buffer copies, returns bytes/s. """
+    src, dst = np.ones(MEMCPY_SIZE, dtype = np.uint8), np.zeros(MEMCPY_SIZE, dtype = np.uint8)
+    n = 0
+    end = time.perf_counter() + duration
+    while time.perf_counter() < end:
+        np.copyto(dst, src)
+        n += 1
+    return n * MEMCPY_SIZE / duration
+
+
+def kernel_compute(duration : float) -> float:
+    """ In-cache matrix products, returns products/s. """
+    a = np.random.default_rng(0).random((COMPUTE_SIZE, COMPUTE_SIZE))
+    b = np.eye(COMPUTE_SIZE) * 0.5
+    n = 0
+    end = time.perf_counter() + duration
+    while time.perf_counter() < end:
+        a = a @ b + 0.5
+        n += 1
+    return n / duration
+
+
+def kernel_syscall(duration : float) -> float:
+    """ Small pwrites with a periodic fsync, returns writes/s. """
+    buf = os.urandom(SYSCALL_SIZE)
+    n = 0
+    with tempfile.TemporaryFile() as f:
+        fd = f.fileno()
+        end = time.perf_counter() + duration
+        while time.perf_counter() < end:
+            os.pwrite(fd, buf, (n % 256) * SYSCALL_SIZE)
+            if n % 64 == 0:
+                os.fsync(fd)
+            n += 1
+    return n / duration
+
+
+KERNELS = {
+    "stream" : kernel_stream,
+    "memcpy" : kernel_memcpy,
+    "compute" : kernel_compute,
+    "syscall" : kernel_syscall,
+}
+
+
+def run_kernel(kernel : str, cpu : int, duration : float, start : float) -> float:
+    """ Run a kernel pinned to a cpu.
+
+    Args:
+        kernel (str): Kernel name.
+        cpu (int): CPU to pin to.
+        duration (float): Run time in seconds.
+        start (float): time.time() at which to start, so that paired kernels overlap.
+
+    Returns:
+        float: Kernel throughput.
+    """
+    os.sched_setaffinity(0, {cpu})
+    time.sleep(max(0, start - time.time()))
+    return KERNELS[kernel](duration)
+
+
+def read_siblings(sysfs_root : str, cpus : list[int]) -> list[tuple[int, int]]:
+    """ Pairs of SMT sibling cpus.
+
+    Args:
+        sysfs_root (str): sysfs mount point.
+        cpus (list[int]): CPUs that may be used.
+
+    Returns:
+        list[tuple[int, int]]: Sibling pairs, one per physical core.
+    """
+    pairs = set()
+    for cpu in cpus:
+        path = os.path.join(sysfs_root, "devices", "system", "cpu", f"cpu{cpu}", "topology", "thread_siblings_list")
+        try:
+            with open(path, "r") as f:
+                text = f.read().strip()
+        except FileNotFoundError:
+            continue
+        siblings = sorted(int(c) for c in text.replace("-", ",").split(",") if c)
+        siblings = [c for c in siblings if c in cpus]
+        if len(siblings) >= 2:
+            pairs.add((siblings[0], siblings[1]))
+    return sorted(pairs)
+
+
+def measure(pool : ProcessPoolExecutor, jobs : list[tuple[str, int]], duration : float) -> list[float]:
+    """ Run kernels at the same time, each on its own cpu. """
+    start = time.time() + 0.5 # leave time for the workers to be ready
+    futures = [pool.submit(run_kernel, k, c, duration, start) for k, c in jobs]
+    return [f.result() for f in futures]
+
+
+def pair_loss(rates : list[float], alone : dict[str, float], k1 : str, k2 : str) -> tuple[float, float]:
+    """ Throughput loss of two kernels run side by side, relative to running alone.
+
+    Args:
+        rates (list[float]): Rates of k1 and k2 run together.
+        alone (dict[str, float]): Rate of each kernel run alone.
+        k1 (str): First kernel.
+        k2 (str): Second kernel.
+
+    Returns:
+        tuple[float, float]: Loss of k1 and of k2, the mean of both when they are the same kernel.
+    """
+    l1, l2 = 1 - rates[0] / alone[k1], 1 - rates[1] / alone[k2]
+    if k1 == k2:
+        l1 = l2 = (l1 + l2) / 2
+    return l1, l2
+
+
+def main(args : argparse.Namespace):
+    cpus = sorted(os.sched_getaffinity(0))
+    siblings = read_siblings(args.sysfs_root, cpus)
+    if len(siblings) < 2:
+        raise Exception("at least two physical cores with SMT siblings are needed")
+    (a, a_sib), (b, _) = siblings[0], siblings[1]
+    print(f"SMT siblings: cpu {a} and {a_sib}, separate core: cpu {b}")
+
+    kernels = args.kernel if args.kernel else list(KERNELS)
+    with ProcessPoolExecutor(max_workers = 2) as pool:
+        alone = {k : measure(pool, [(k, a)], args.duration)[0] for k in kernels}
+
+        smt_loss, core_loss = {k : {} for k in kernels}, {k : {} for k in kernels}
+        for k1, k2 in itertools.combinations_with_replacement(kernels, 2):
+            smt_loss[k1][k2], smt_loss[k2][k1] = pair_loss(measure(pool, [(k1, a), (k2, a_sib)], args.duration), alone, k1, k2)
+            core_loss[k1][k2], core_loss[k2][k1] = pair_loss(measure(pool, [(k1, a), (k2, b)], args.duration), alone, k1, k2)
+            print(f"  -> {k1} + {k2}: SMT loss {smt_loss[k1][k2]:.1%} / {smt_loss[k2][k1]:.1%}, separate cores loss {core_loss[k1][k2]:.1%} / {core_loss[k2][k1]:.1%}")
+
+    table = Table(title = "throughput loss on SMT siblings (row kernel, when paired with column kernel)")
+    table.add_column("")
+    for k in kernels:
+        table.add_column(k)
+    for k1 in kernels:
+        table.add_row(k1, *[f"{smt_loss[k1][k2]:.1%}" for k2 in kernels])
+    print(table)
+
+    # two thread types may be SMT neighbours if neither loses more than the threshold
+    roles = [r for r in THREAD_ROLES if ROLE_KERNELS[r] in kernels]
+    compatible = {}
+    for r1 in roles:
+        k1 = ROLE_KERNELS[r1]
+        compatible[r1] = [r2 for r2 in roles if max(smt_loss[k1][ROLE_KERNELS[r2]], smt_loss[ROLE_KERNELS[r2]][k1]) <= args.threshold]
+
+    matrix = {
+        "duration" : args.duration,
+        "threshold" : args.threshold,
+        "cpus" : {"smt" : [a, a_sib], "separate" : [a, b]},
+        "alone" : alone,
+        "smt_loss" : smt_loss,
+        "core_loss" : core_loss,
+        "role_kernels" : {r : ROLE_KERNELS[r] for r in roles},
+        "compatible" : compatible,
+    }
+    with open(args.output, "w") as f:
+        json.dump(matrix, f, indent = 4)
+    print(f"compatibility matrix has been written to {args.output}")
+    return
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser("Measure the interference of thread types sharing a physical core.")
+    parser.add_argument("-d", "--duration", type = float, default = 3, help = "run time of each measurement in seconds.")
+    parser.add_argument("-k", "--kernel", action = "append", choices = list(KERNELS), help = "kernel to run, repeat for several (default all).")
+    parser.add_argument("--threshold", type = float, default = 0.15, help = "maximum throughput loss for two thread types to be allowed as SMT neighbours.")
+    parser.add_argument("--sysfs_root", type = str, default = "/sys", help = "sysfs mount point.")
+    parser.add_argument("-o", "--output", type = str, default = "smt-matrix.json", help = "output json file.")
+
+    args = parser.parse_args()
+    main(args)
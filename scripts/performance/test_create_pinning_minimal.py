@@ -0,0 +1,87 @@
+"""
+Description: Tests of create_pinning_minimal.py with the fake numactl layouts (-f), run with `python -m pytest` from this directory.
+"""
+import argparse
+import json
+import subprocess
+
+import pytest
+
+import create_pinning_minimal
+
+MAX_CPUS = {"rte" : 1, "tpproc" : 2, "rawproc" : 16, "ccp" : 6, "recording" : 6}
+
+
+def fake_numa_info(host : str) -> tuple[dict, int]:
+    """ numactl output without cpus, they are filled in by the fake layout. """
+    return {"0" : {"cpus" : [], "size" : 1, "free" : 1}, "1" : {"cpus" : [], "size" : 1, "free" : 1}}, 2
+
+
+def run(tmp_path, monkeypatch, server : str, **kwargs) -> dict[str, dict]:
+    """ Run the generator in tmp_path without ssh, and return the files written. """
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setattr(create_pinning_minimal, "get_numa_info", fake_numa_info)
+    monkeypatch.setattr(create_pinning_minimal, "run_command", lambda host, cmd : subprocess.CompletedProcess(["ssh", host, cmd], 255, b"", b"")) # host not reachable
+    monkeypatch.setattr(create_pinning_minimal, "max_cpus_default", MAX_CPUS, raising = False)
+    args = argparse.Namespace(readout_server = server, fake = True, num_apps = 1, template = None, noise_profile = None, noise_threshold = None,
+                              smt_matrix = None, smt_strict = False, partition = None, **MAX_CPUS)
+    for k, v in kwargs.items():
+        setattr(args, k, v)
+    create_pinning_minimal.main(args)
+    return {p.name : json.loads(p.read_text()) for p in tmp_path.glob("*.json") if p.name != "sessions.json"}
+
+
+def write_sessions(tmp_path, sessions : dict) -> str:
+    path = tmp_path / "sessions.json"
+    path.write_text(json.dumps({"sessions" : sessions}))
+    return str(path)
+
+
+def test_np02_partition(tmp_path, monkeypatch):
+    """ np02 cpu numbers go up in steps of 2 on a numa node, recording must still get all its cpus. """
+    sessions = write_sessions(tmp_path, {"prod" : {"numa" : [0], "num_apps" : 1}, "test" : {"numa" : [1]}})
+    out = run(tmp_path, monkeypatch, "np02-srv-003", partition = sessions)
+
+    roles = create_pinning_minimal.pinned_roles(out["cpupin-prod-running.json"])
+    prod = roles["--name prod-runp02srv003eth0"]
+    assert prod["recording"] == {100, 102, 104, 106, 108, 110}
+    assert all(c % 2 == 0 for r in prod.values() for c in r)
+    assert create_pinning_minimal.pinned_cpus(out["cpupin-test-running.json"]) <= set(range(1, 112, 2))
+
+
+def test_np04_pre_conf_parent(tmp_path, monkeypatch):
+    """ Before the configuration the parent can use all the cpus of its numa node, also with two regions per numa node. """
+    out = run(tmp_path, monkeypatch, "np04-srv-031", num_apps = 3)
+
+    numa_cpus = [list(range(0, 32)) + list(range(64, 96)), list(range(32, 64)) + list(range(96, 128))]
+    parents = {k : create_pinning_minimal.str_to_cpu_list(v["parent"]) for k, v in out["cpupin-all.json"]["daq_application"].items()}
+    assert parents == {"--name runp04srv031eth00" : numa_cpus[0], "--name runp04srv031eth01" : numa_cpus[0], "--name runp04srv031eth10" : numa_cpus[1]}
+    # the running pinning is made from what is left after the first core and hypercore of each numa node
+    assert not create_pinning_minimal.pinned_cpus(out["cpupin-all-running.json"]) & {0, 64, 32, 96}
+
+
+@pytest.mark.parametrize("quota, message", [
+    ({"numa" : [2]}, "numa nodes \\[2\\], the host has numa nodes 0 to 1"),
+    ({"cores" : 10}, "must give its numa nodes"),
+    ({"numa" : [0], "cores" : 0}, "\"cores\" must be a positive integer"),
+])
+def test_invalid_quota(tmp_path, monkeypatch, quota, message):
+    sessions = write_sessions(tmp_path, {"prod" : quota})
+    with pytest.raises(Exception, match = message):
+        run(tmp_path, monkeypatch, "np04-srv-031", partition = sessions)
+    assert not (tmp_path / "partition.json").exists()
+
+
+def test_shared_mem_nodes(tmp_path, monkeypatch, capsys):
+    """ Sessions sharing a numa node share its memory: reported, or refused when exclusive memory is asked for. """
+    sessions = {"prod" : {"numa" : [0], "cores" : 10, "devices" : ["0000:17:00.0"]}, "test" : {"numa" : [0, 1]}}
+    small = {"rawproc" : 4, "ccp" : 2, "recording" : 2} # 14 cpus per daq application, so that two fit on a numa node
+    out = run(tmp_path, monkeypatch, "np04-srv-031", partition = write_sessions(tmp_path, sessions), **small)
+
+    assert out["partition.json"]["prod"]["shared_mem_nodes"] == {"0" : ["test"]}
+    assert out["partition.json"]["test"]["shared_mem_nodes"] == {"0" : ["prod"]}
+    assert "numa of device 0000:17:00.0 of session prod could not be found" in capsys.readouterr().out
+
+    sessions["prod"]["exclusive_memory"] = True
+    with pytest.raises(Exception, match = "exclusive memory"):
+        run(tmp_path, monkeypatch, "np04-srv-031", partition = write_sessions(tmp_path, sessions), **small)
@@ -0,0 +1,88 @@
+"""
+Description: Tests of perf_counters.py on a simulated procfs/sysfs tree with a FakeBackend, run with `python -m pytest` from this directory.
+"""
+import os
+
+import perf_counters
+
+PINNING = {"daq_application" : {"--name ru0" : {"parent" : "0-3", "threads" : {"rawproc-0-1.." : "1", "rte-worker-0" : "2,5"}}}}
+
+# perf stat -x, --per-thread writes "<comm>-<tid>,<count>,<unit>,<event>,<run time>,<enabled %>,..." to stderr
+PERF_STAT = """# started on Mon Jan  1 00:00:00 2024
+
+rawproc-0-100-101,4000,,instructions,5000000000,100.00,,
+rawproc-0-100-101,2000,,cycles,5000000000,100.00,,
+rawproc-0-100-101,<not counted>,,node-loads,0,0.00,,
+rte-worker-0-102,900,,instructions,5000000000,100.00,,
+"""
+
+
+def write(path : str, text : str):
+    os.makedirs(os.path.dirname(path), exist_ok = True)
+    with open(path, "w") as f:
+        f.write(text)
+
+
+def make_proc(procfs : str, pid : int, cmdline : list[str], threads : dict[int, str]):
+    """ Simulated /proc/<pid>, with the comm of each thread. """
+    write(os.path.join(procfs, str(pid), "cmdline"), "\0".join(cmdline) + "\0")
+    for tid, comm in threads.items():
+        write(os.path.join(procfs, str(pid), "task", str(tid), "comm"), comm + "\n")
+
+
+def make_tree(tmp_path) -> tuple[str, str]:
+    """ Simulated procfs with one daq application and another process, and sysfs with two numa nodes of 4 cpus. """
+    procfs, sysfs = str(tmp_path / "proc"), str(tmp_path / "sys")
+    make_proc(procfs, 100, ["daq_application", "--name", "ru0"], {100 : "daq_application", 101 : "rawproc-0-100", 102 : "rte-worker-0"})
+    make_proc(procfs, 200, ["daq_application", "--name", "ru1"], {200 : "daq_application", 201 : "rawproc-0-100"})
+    write(os.path.join(sysfs, "devices", "system", "node", "node0", "cpulist"), "0-3\n")
+    write(os.path.join(sysfs, "devices", "system", "node", "node1", "cpulist"), "4-7\n")
+    return procfs, sysfs
+
+
+def test_find_threads(tmp_path):
+    procfs, _ = make_tree(tmp_path)
+
+    threads = perf_counters.find_threads(PINNING, procfs)
+
+    assert [(t["tid"], t["role"], t["cpus"]) for t in threads] == [(100, "parent", [0, 1, 2, 3]), (101, "rawproc", [1]), (102, "rte-worker", [2, 5])]
+    assert all(t["app"] == "ru0" for t in threads)
+
+
+def test_find_threads_process_exited(tmp_path):
+    """ A process without its task directory (it exited during the scan) is skipped. """
+    procfs, _ = make_tree(tmp_path)
+    make_proc(procfs, 300, ["daq_application", "--name", "ru0"], {})
+
+    assert [t["tid"] for t in perf_counters.find_threads(PINNING, procfs)] == [100, 101, 102]
+
+
+def test_aggregate(tmp_path):
+    procfs, sysfs = make_tree(tmp_path)
+    backend = perf_counters.FakeBackend({
+        100 : {"instructions" : 100, "cycles" : 100, "node-loads" : 100, "node-load-misses" : 0},
+        101 : {"instructions" : 3000, "cycles" : 1000, "LLC-load-misses" : 30, "node-loads" : 100, "node-load-misses" : 50},
+        102 : {"instructions" : 1000, "cycles" : 2000, "node-loads" : 100, "node-load-misses" : 10},
+        201 : {"instructions" : 1, "cycles" : 1},
+    })
+    threads = perf_counters.find_threads(PINNING, procfs)
+
+    results = perf_counters.aggregate(threads, backend.sample([t["tid"] for t in threads], 0), perf_counters.numa_of_cpus(sysfs), 0.2)
+    by_role = {r["role"] : r for r in results}
+
+    assert sorted(by_role) == ["parent", "rawproc", "rte-worker"]
+    assert by_role["rawproc"]["ipc"] == 3
+    assert by_role["rawproc"]["llc_mpki"] == 10
+    assert by_role["rawproc"]["remote_ratio"] == 0.5
+    assert by_role["rawproc"]["nodes"] == [0]
+    assert len(by_role["rawproc"]["flags"]) == 1 and "remote" in by_role["rawproc"]["flags"][0]
+    assert by_role["rte-worker"]["ipc"] == 0.5
+    assert by_role["rte-worker"]["nodes"] == [0, 1]
+    assert by_role["rte-worker"]["flags"] == ["pinned to cpus of numa nodes [0, 1]"]
+    assert by_role["parent"]["flags"] == []
+
+
+def test_parse_perf_stat():
+    counts = perf_counters.parse_perf_stat(PERF_STAT)
+
+    assert counts == {101 : {"instructions" : 4000, "cycles" : 2000, "node-loads" : None}, 102 : {"instructions" : 900}}
@@ -0,0 +1,116 @@
+"""
+Description: Tests of perf_mode.py on a simulated sysfs tree, run with `python -m pytest` from this directory.
+"""
+import argparse
+import json
+import os
+
+import pytest
+
+import perf_mode
+
+CPU_DIR = os.path.join("devices", "system", "cpu")
+IDLE_STATES = {"state0" : 0, "state1" : 2, "state2" : 100} # exit latency (us)
+
+
+def write(path : str, text : str):
+    os.makedirs(os.path.dirname(path), exist_ok = True)
+    with open(path, "w") as f:
+        f.write(text + "\n")
+
+
+def read(sysfs : str, *parts : str) -> str:
+    with open(os.path.join(sysfs, CPU_DIR, *parts), "r") as f:
+        return f.read().strip()
+
+
+def make_tree(tmp_path, boost : str = "intel_pstate") -> str:
+    """ Simulated sysfs with 4 cpus in powersave, deep C-states enabled and turbo disabled. """
+    sysfs = str(tmp_path / "sys")
+    for cpu in range(4):
+        cpufreq = os.path.join(sysfs, CPU_DIR, f"cpu{cpu}", "cpufreq")
+        write(os.path.join(cpufreq, "scaling_governor"), "powersave")
+        write(os.path.join(cpufreq, "energy_performance_preference"), "balance_power")
+        write(os.path.join(cpufreq, "scaling_min_freq"), "800000")
+        write(os.path.join(cpufreq, "cpuinfo_max_freq"), "3000000")
+        for s, latency in IDLE_STATES.items():
+            write(os.path.join(sysfs, CPU_DIR, f"cpu{cpu}", "cpuidle", s, "latency"), str(latency))
+            write(os.path.join(sysfs, CPU_DIR, f"cpu{cpu}", "cpuidle", s, "disable"), "0")
+    if boost == "intel_pstate":
+        write(os.path.join(sysfs, CPU_DIR, "intel_pstate", "no_turbo"), "1")
+    else:
+        write(os.path.join(sysfs, CPU_DIR, "cpufreq", "boost"), "0")
+    return sysfs
+
+
+def run(tmp_path, sysfs : str, action : str, cpus : str = "1-2", **kwargs) -> bool:
+    args = argparse.Namespace(action = action, pinning = None, cpus = cpus, state = str(tmp_path / "state.json"), force = False, sysfs_root = sysfs,
+                              governor = "performance", epp = "performance", no_boost = False, max_latency = 2, lock_freq = False)
+    for k, v in kwargs.items():
+        setattr(args, k, v)
+    return perf_mode.main(args)
+
+
+def test_capture_apply_verify_restore(tmp_path):
+    sysfs = make_tree(tmp_path)
+
+    assert run(tmp_path, sysfs, "capture")
+    assert not run(tmp_path, sysfs, "verify")
+    assert run(tmp_path, sysfs, "apply")
+    assert run(tmp_path, sysfs, "verify")
+
+    for cpu in [1, 2]:
+        assert read(sysfs, f"cpu{cpu}", "cpufreq", "scaling_governor") == "performance"
+        assert read(sysfs, f"cpu{cpu}", "cpufreq", "energy_performance_preference") == "performance"
+        assert [read(sysfs, f"cpu{cpu}", "cpuidle", s, "disable") for s in IDLE_STATES] == ["0", "0", "1"]
+    assert read(sysfs, "cpu0", "cpufreq", "scaling_governor") == "powersave" # not pinned
+    assert read(sysfs, "cpu1", "cpufreq", "scaling_min_freq") == "800000" # --lock_freq not given
+
+    assert run(tmp_path, sysfs, "restore")
+    for cpu in [1, 2]:
+        assert read(sysfs, f"cpu{cpu}", "cpufreq", "scaling_governor") == "powersave"
+        assert read(sysfs, f"cpu{cpu}", "cpufreq", "energy_performance_preference") == "balance_power"
+        assert read(sysfs, f"cpu{cpu}", "cpuidle", "state2", "disable") == "0"
+    assert read(sysfs, "intel_pstate", "no_turbo") == "1"
+    assert not os.path.exists(tmp_path / "state.json")
+
+
+def test_boost_switch(tmp_path):
+    """ intel_pstate no_turbo is inverted, cpufreq boost is not. """
+    sysfs = make_tree(tmp_path)
+    run(tmp_path, sysfs, "apply")
+    assert read(sysfs, "intel_pstate", "no_turbo") == "0"
+    run(tmp_path, sysfs, "apply", no_boost = True)
+    assert read(sysfs, "intel_pstate", "no_turbo") == "1"
+
+    sysfs = make_tree(tmp_path / "boost", boost = "cpufreq")
+    run(tmp_path / "boost", sysfs, "apply")
+    assert read(sysfs, "cpufreq", "boost") == "1"
+
+
+def test_apply_twice_keeps_original_state(tmp_path):
+    sysfs = make_tree(tmp_path)
+
+    assert run(tmp_path, sysfs, "apply")
+    assert run(tmp_path, sysfs, "apply")
+    with open(tmp_path / "state.json", "r") as f:
+        assert json.load(f)["cpus"]["1"]["governor"] == "powersave"
+
+    assert run(tmp_path, sysfs, "restore")
+    assert read(sysfs, "cpu1", "cpufreq", "scaling_governor") == "powersave"
+    assert read(sysfs, "intel_pstate", "no_turbo") == "1"
+
+
+def test_state_file_of_other_cpus(tmp_path):
+    sysfs = make_tree(tmp_path)
+    assert run(tmp_path, sysfs, "capture")
+
+    with pytest.raises(Exception, match = "already exists"):
+        run(tmp_path, sysfs, "capture")
+    with pytest.raises(Exception, match = "holds the settings of cpus"):
+        run(tmp_path, sysfs, "apply", cpus = "1-3")
+    assert read(sysfs, "cpu3", "cpufreq", "scaling_governor") == "powersave" # nothing applied
+
+    assert run(tmp_path, sysfs, "apply", cpus = "1-3", force = True)
+    with open(tmp_path / "state.json", "r") as f:
+        assert sorted(json.load(f)["cpus"]) == ["1", "2", "3"]
@@ -0,0 +1,90 @@
+"""
+Description: Tests of sched_latency.py on saved traces (no root needed), run with `python -m pytest` from this directory.
+"""
+import pytest
+
+import sched_latency
+
+PINNING = {"daq_application" : {"--name ru0" : {"parent" : None, "threads" : {"rawproc-0-1.." : "2"}}}}
+
+
+def wakeup(ts : float, cpu : int, comm : str, pid : int, target : int, waker : str = "rte-worker-0-102") -> str:
+    return f"{waker:>24} [{cpu:03d}] d..2. {ts:.6f}: sched_wakeup: comm={comm} pid={pid} prio=120 target_cpu={target:03d}\n"
+
+
+def switch(ts : float, cpu : int, prev : str, prev_pid : int, state : str, nxt : str, next_pid : int) -> str:
+    return f"{prev + '-' + str(prev_pid):>24} [{cpu:03d}] d..2. {ts:.6f}: sched_switch: prev_comm={prev} prev_pid={prev_pid} prev_prio=120 prev_state={state} ==> next_comm={nxt} next_pid={next_pid} next_prio=120\n"
+
+
+TRACE = [
+    "# tracer: nop\n",
+    "#\n",
+    wakeup(1000.000010, 5, "rawproc-0-100", 101, 2),
+    switch(1000.000060, 2, "swapper/2", 0, "R", "rawproc-0-100", 101), # woken 50 us ago
+    switch(1000.000100, 2, "rawproc-0-100", 101, "R+", "kworker/2:1", 77), # preempted
+    switch(1000.000400, 2, "kworker/2:1", 77, "S", "rawproc-0-100", 101), # back after 300 us
+    switch(1000.000500, 2, "rawproc-0-100", 101, "S", "swapper/2", 0), # sleeps, not a preemption
+    wakeup(1000.001000, 5, "rawproc-0-100", 101, 7), # migrated to a cpu that is not pinned
+    switch(1000.001200, 7, "swapper/7", 0, "R", "rawproc-0-100", 101),
+]
+
+
+def run(tmp_path, lines : list[str], cpus : set[int]) -> dict:
+    """ Replay a saved trace through the same pipeline as main. """
+    path = tmp_path / "sched.trace"
+    path.write_text("".join(lines))
+    events = sched_latency.parse_events(sched_latency.read_trace_file(str(path)))
+    return sched_latency.analyse(sched_latency.filter_cpus(events, cpus), sched_latency.pinning_matcher(PINNING))
+
+
+def test_replay(tmp_path):
+    stats = run(tmp_path, TRACE, {2})
+
+    assert list(stats) == [("rawproc-0-100", 101)] # thread names with "-", the wakers are not tracked
+    s = stats[("rawproc-0-100", 101)]
+    assert s.role == "rawproc"
+    assert s.wakeup.count == 1 # the wakeup targeting cpu 7 is filtered out
+    assert s.wakeup.max == pytest.approx(50, abs = 1)
+    assert s.preemption.count == 1
+    assert s.preemption.total == pytest.approx(300, abs = 1)
+    assert list(s.displacers) == ["kworker/2:1"]
+    assert s.displacers["kworker/2:1"][0] == 1
+
+
+def test_replay_all_cpus(tmp_path):
+    stats = run(tmp_path, TRACE, set())
+
+    s = stats[("rawproc-0-100", 101)]
+    assert s.wakeup.count == 2
+    assert s.wakeup.max == pytest.approx(200, abs = 1)
+
+
+def test_displacers_other(tmp_path):
+    """ The displacers beyond MAX_DISPLACERS are summed as "other". """
+    lines = []
+    ts = 1000.
+    for i in range(sched_latency.MAX_DISPLACERS + 2):
+        lines.append(switch(ts, 2, "rawproc-0-100", 101, "R+", f"task-{i}", 200 + i))
+        lines.append(switch(ts + 0.00001, 2, f"task-{i}", 200 + i, "S", "rawproc-0-100", 101))
+        ts += 0.001
+
+    s = run(tmp_path, lines, {2})[("rawproc-0-100", 101)]
+
+    assert s.preemption.count == sched_latency.MAX_DISPLACERS + 2
+    assert len(s.displacers) == sched_latency.MAX_DISPLACERS + 1
+    assert s.displacers["other"][0] == 2
+    assert "task-0" in s.displacers and f"task-{sched_latency.MAX_DISPLACERS + 1}" not in s.displacers
+
+
+def test_histogram_percentiles():
+    h = sched_latency.Histogram()
+    assert h.percentile(50) == 0
+
+    for v in [0.5, 1, 3, 100]:
+        h.add(v)
+
+    assert h.buckets[0] == 2 and h.buckets[1] == 1 and h.buckets[6] == 1
+    assert h.percentile(50) == 2 # upper edge of the [1, 2) us bucket
+    assert h.percentile(75) == 4
+    assert h.percentile(99) == 100 # capped by the largest value
+    assert h.to_dict()["count"] == 4
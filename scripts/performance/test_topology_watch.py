@@ -0,0 +1,134 @@
+"""
+Description: Tests of topology_watch.py on a simulated sysfs/procfs tree, run with `python -m pytest` from this directory.
+"""
+import os
+
+import topology_watch
+
+MDSTAT = """Personalities : [raid0]
+md127 : active raid0 nvme1n1[1] nvme0n1[0]
+      1875118080 blocks super 1.2 [2/2] [UU]
+
+unused devices: <none>
+"""
+
+
+def write(path : str, text : str):
+    os.makedirs(os.path.dirname(path), exist_ok = True)
+    with open(path, "w") as f:
+        f.write(text)
+
+
+def make_tree(tmp_path) -> tuple[str, str]:
+    """ Simulated sysfs and procfs roots: 4 online cpus, one Xilinx card, one NVMe RAID. """
+    sysfs, procfs = str(tmp_path / "sys"), str(tmp_path / "proc")
+    write(os.path.join(sysfs, "devices", "system", "cpu", "online"), "0-3\n")
+    card = os.path.join(sysfs, "bus", "pci", "devices", "0000:17:00.0")
+    write(os.path.join(card, "vendor"), "0x10ee\n")
+    write(os.path.join(card, "class"), "0x058000\n")
+    write(os.path.join(card, "numa_node"), "0\n")
+    os.makedirs(os.path.join(sysfs, "block", "nvme0n1"))
+    write(os.path.join(procfs, "mdstat"), MDSTAT)
+    return sysfs, procfs
+
+
+def set_online(sysfs : str, cpus : str):
+    """ Change the online cpus without changing the mtime of the file, as on a real sysfs. """
+    path = os.path.join(sysfs, "devices", "system", "cpu", "online")
+    st = os.stat(path)
+    write(path, cpus + "\n")
+    os.utime(path, ns = (st.st_atime_ns, st.st_mtime_ns))
+
+
+def test_watch_injected_source(tmp_path):
+    sysfs, procfs = make_tree(tmp_path)
+    pinning = {"daq_application" : {"--name ru0" : {"parent" : "1", "threads" : {"rawproc-0-1.." : "2,3"}}}}
+    events = []
+
+    def source():
+        set_online(sysfs, "0-2")
+        yield "offline@/devices/system/cpu/cpu3"
+        yield None # nothing changed
+        set_online(sysfs, "0-3")
+        yield "online@/devices/system/cpu/cpu3"
+
+    topology_watch.watch(sysfs, procfs, source(), events.append, pinning)
+
+    assert [e["type"] for e in events] == ["cpu_offline", "pinning_invalid", "cpu_online", "pinning_valid"]
+    assert events[0]["cpu"] == 3
+    assert events[1]["missing_cpus"] == [3]
+
+
+def test_watch_devices_and_raid(tmp_path):
+    sysfs, procfs = make_tree(tmp_path)
+    events = []
+
+    def source():
+        write(os.path.join(procfs, "mdstat"), MDSTAT.replace("[2/2] [UU]", "[2/1] [U_]"))
+        os.rmdir(os.path.join(sysfs, "block", "nvme0n1"))
+        yield "remove@/block/nvme0n1"
+
+    topology_watch.watch(sysfs, procfs, source(), events.append)
+
+    assert [e["type"] for e in events] == ["nvme_removed", "raid_changed"]
+    assert events[1]["new"]["active"] == 1
+
+
+def test_watch_device_removed(tmp_path):
+    """ Removing the card invalidates a pinning that reads from it, by PCI address or network interface. """
+    sysfs, procfs = make_tree(tmp_path)
+    card = os.path.join(sysfs, "bus", "pci", "devices", "0000:17:00.0")
+    os.makedirs(os.path.join(sysfs, "class", "net", "eth0"))
+    os.symlink(card, os.path.join(sysfs, "class", "net", "eth0", "device"))
+    pinning = {"daq_application" : {"--name ru0" : {"device" : "17:00.0", "parent" : None, "threads" : {"rawproc-0-1.." : None}}}}
+    events = []
+
+    def source():
+        for f in os.listdir(card):
+            os.remove(os.path.join(card, f))
+        os.rmdir(card)
+        yield "remove@/devices/pci0000:16/0000:16:00.0/0000:17:00.0"
+
+    topology_watch.watch(sysfs, procfs, source(), events.append, pinning, ["eth0"])
+
+    assert [e["type"] for e in events] == ["device_removed", "pinning_invalid"]
+    assert events[0]["device"] == "0000:17:00.0"
+    assert events[1]["missing_devices"] == ["17:00.0", "eth0"]
+    assert events[1]["missing_cpus"] == []
+
+
+def test_check_partition_devices(tmp_path):
+    sysfs, procfs = make_tree(tmp_path)
+    partition = {"prod" : {"devices" : ["0000:17:00.0"]}, "test" : {"devices" : ["0000:65:00.0"]}}
+
+    status = topology_watch.check_pinning(None, topology_watch.snapshot(sysfs, procfs), topology_watch.partition_devices(partition))
+    assert status == {"missing_cpus" : [], "missing_devices" : ["0000:65:00.0"]}
+
+
+def fake_sleep(change : callable) -> callable:
+    """ time.sleep replacement making one change at the first poll, and failing if polling goes on. """
+    calls = []
+    def sleep(_):
+        calls.append(None)
+        if len(calls) == 1:
+            change()
+        elif len(calls) > 3:
+            raise AssertionError("the change was not detected")
+    return sleep
+
+
+def test_poll_source_detects_cpu_offline(tmp_path, monkeypatch):
+    """ The online cpus are detected by content, their mtime does not change. """
+    sysfs, procfs = make_tree(tmp_path)
+    monkeypatch.setattr(topology_watch.time, "sleep", fake_sleep(lambda : set_online(sysfs, "0-2")))
+
+    source = topology_watch.poll_source(sysfs, procfs, 0)
+    assert next(source) == "devices/system/cpu/online"
+
+
+def test_poll_source_detects_mdstat(tmp_path, monkeypatch):
+    sysfs, procfs = make_tree(tmp_path)
+    monkeypatch.setattr(topology_watch.time, "sleep", fake_sleep(lambda : write(os.path.join(procfs, "mdstat"), MDSTAT.replace("active", "inactive"))))
+
+    source = topology_watch.poll_source(sysfs, procfs, 0)
+    assert next(source) == "mdstat"
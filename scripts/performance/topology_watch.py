@@ -0,0 +1,317 @@
+#!/usr/bin/env python
+"""
+Description: Watch the host topology and report changes as json events.
+
+A topology snapshot (online cpus, readout PCIe devices, NVMe block devices, md RAIDs)
+is taken at start and again every time the event source fires. Only the differences
+between two snapshots are emitted, one json object per line, e.g.
+
+    {"time": 1700000000.0, "type": "cpu_offline", "cpu": 12}
+    {"time": 1700000000.0, "type": "raid_changed", "raid": "md127", "old": {...}, "new": {...}}
+
+If a pinning file (or devices) is given, a "pinning_invalid" event is emitted when it
+references cpus that are not online, or devices that are not present (and "pinning_valid"
+once they are back). The devices are the "device" entries of a template pinning file, the session
+devices of a partition.json file made by create_pinning_minimal.py, or given on the
+command line, as PCI addresses or network interface names.
+
+The event source is a kernel uevent netlink socket (udev events: hotplug, cpu
+online/offline, device add/remove), with a timeout so that /proc/mdstat is still
+polled; if the socket cannot be opened, the online cpus, the mtimes of the sysfs
+device directories and /proc/mdstat are polled instead. Any iterable can be injected as the source, which together with the
+sysfs/procfs roots makes the watcher testable on a simulated tree.
+"""
+import argparse
+import hashlib
+import json
+import os
+import socket
+import sys
+import time
+
+from rich import print
+
+from create_pinning_minimal import pinned_cpus, str_to_cpu_list
+from host_info import read_mdstat, read_pci_devices, read_value
+
+NETLINK_KOBJECT_UEVENT = 15
+
+# sysfs directories whose mtimes are polled when uevents are not available
+POLL_DIRS = [
+    "bus/pci/devices",
+    "block",
+]
+# files whose content is polled, sysfs attributes keep their mtime when their value changes
+POLL_FILES = [
+    ("sysfs", "devices/system/cpu/online"),
+    ("procfs", "mdstat"),
+]
+
+
+def snapshot(sysfs_root : str, procfs_root : str) -> dict:
+    """ Read the current topology.
+
+    Args:
+        sysfs_root (str): sysfs mount point.
+        procfs_root (str): procfs mount point.
+
+    Returns:
+        dict: Online cpus, PCIe devices, network interfaces (with their PCI address), NVMe block devices and RAIDs.
+    """
+    block_dir = os.path.join(sysfs_root, "block")
+    net_dir = os.path.join(sysfs_root, "class", "net")
+    interfaces = {}
+    if os.path.isdir(net_dir):
+        for i in os.listdir(net_dir):
+            link = os.path.join(net_dir, i, "device")
+            if os.path.exists(link):
+                interfaces[i] = os.path.basename(os.path.realpath(link))
+    return {
+        "cpus" : set(str_to_cpu_list(read_value(os.path.join(sysfs_root, "devices", "system", "cpu", "online")) or "")),
+        "devices" : {d : {"category" : c, "node" : n} for d, c, n in read_pci_devices(sysfs_root)},
+        "interfaces" : interfaces,
+        "nvme" : set(b for b in os.listdir(block_dir) if b.startswith("nvme")) if os.path.isdir(block_dir) else set(),
+        "raids" : read_mdstat(os.path.join(procfs_root, "mdstat")),
+    }
+
+
+def diff(old : dict, new : dict) -> list[dict]:
+    """ Changes between two topology snapshots.
+
+    Args:
+        old (dict): Previous snapshot.
+        new (dict): Current snapshot.
+
+    Returns:
+        list[dict]: Change events.
+    """
+    events = []
+    for c in sorted(old["cpus"] - new["cpus"]):
+        events.append({"type" : "cpu_offline", "cpu" : c})
+    for c in sorted(new["cpus"] - old["cpus"]):
+        events.append({"type" : "cpu_online", "cpu" : c})
+
+    for d in sorted(old["devices"].keys() - new["devices"].keys()):
+        events.append({"type" : "device_removed", "device" : d, **old["devices"][d]})
+    for d in sorted(new["devices"].keys() - old["devices"].keys()):
+        events.append({"type" : "device_added", "device" : d, **new["devices"][d]})
+    for d in sorted(old["devices"].keys() & new["devices"].keys()):
+        if old["devices"][d] != new["devices"][d]:
+            events.append({"type" : "device_changed", "device" : d, "old" : old["devices"][d], "new" : new["devices"][d]})
+
+    for b in sorted(old["nvme"] - new["nvme"]):
+        events.append({"type" : "nvme_removed", "block" : b})
+    for b in sorted(new["nvme"] - old["nvme"]):
+        events.append({"type" : "nvme_added", "block" : b})
+
+    for r in sorted(old["raids"].keys() - new["raids"].keys()):
+        events.append({"type" : "raid_removed", "raid" : r})
+    for r in sorted(new["raids"].keys() - old["raids"].keys()):
+        events.append({"type" : "raid_added", "raid" : r, **new["raids"][r]})
+    for r in sorted(old["raids"].keys() & new["raids"].keys()):
+        if old["raids"][r] != new["raids"][r]:
+            events.append({"type" : "raid_changed", "raid" : r, "old" : old["raids"][r], "new" : new["raids"][r]})
+    return events
+
+
+def pinning_devices(pinning : dict) -> list[str]:
+    """ Devices the applications of a template pinning file read from.
+
+    Args:
+        pinning (dict): Pinning configuration.
+
+    Returns:
+        list[str]: PCI addresses or network interface names.
+    """
+    return [app["device"] for app in pinning.get("daq_application", {}).values() if app.get("device")]
+
+
+def partition_devices(partition : dict) -> list[str]:
+    """ Devices of the sessions of a partition.json file.
+
+    Args:
+        partition (dict): Session summaries.
+
+    Returns:
+        list[str]: PCI addresses or network interface names.
+    """
+    return [d for session in partition.values() for d in session.get("devices", [])]
+
+
+def device_present(device : str, topology : dict) -> bool:
+    """ Whether a device is in the topology.
+
+    Args:
+        device (str): PCI address (with or without the domain) or network interface name.
+        topology (dict): Topology snapshot.
+
+    Returns:
+        bool: The device, or the PCI device of the interface, is present.
+    """
+    if ":" not in device:
+        if device not in topology["interfaces"]:
+            return False
+        device = topology["interfaces"][device]
+    if device.count(":") == 1:
+        device = "0000:" + device
+    return device in topology["devices"]
+
+
+def check_pinning(pinning : dict, topology : dict, devices : list[str] = None) -> dict:
+    """ Find what a pinning file references that is not in the topology.
+
+    Args:
+        pinning (dict): Pinning configuration, None to only check the devices.
+        topology (dict): Topology snapshot.
+        devices (list[str], optional): Devices the pinning relies on. Defaults to None.
+
+    Returns:
+        dict: Missing cpus and devices.
+    """
+    cpus = pinned_cpus(pinning) if pinning else set()
+    return {"missing_cpus" : sorted(cpus - topology["cpus"]), "missing_devices" : sorted(d for d in (devices or []) if not device_present(d, topology))}
+
+
+def open_uevent_socket() -> socket.socket:
+    """ Open a netlink socket subscribed to the kernel uevents.
+
+    Raises:
+        OSError: The netlink socket could not be opened.
+
+    Returns:
+        socket.socket: Uevent socket.
+    """
+    sock = socket.socket(socket.AF_NETLINK, socket.SOCK_DGRAM, NETLINK_KOBJECT_UEVENT)
+    sock.bind((0, 1))
+    return sock
+
+
+def uevent_source(sock : socket.socket, timeout : float):
+    """ Yield on every kernel uevent, or after timeout seconds without one.
+
+    Args:
+        sock (socket.socket): Uevent socket.
+        timeout (float): Maximum time between two yields, so that files without uevents are still polled.
+
+    Yields:
+        str: First line of the uevent (e.g. "offline@/devices/system/cpu/cpu12"), or None on timeout.
+    """
+    sock.settimeout(timeout)
+    with sock:
+        while True:
+            try:
+                data = sock.recv(16384)
+                yield data.split(b"\0")[0].decode("utf-8", "replace")
+            except socket.timeout:
+                yield None
+
+
+def poll_source(sysfs_root : str, procfs_root : str, interval : float):
+    """ Yield when the mtime of a watched sysfs directory, or the content of the online cpus or /proc/mdstat, changes.
+
+    Args:
+        sysfs_root (str): sysfs mount point.
+        procfs_root (str): procfs mount point.
+        interval (float): Seconds between two polls.
+
+    Yields:
+        str: Name of the path that changed.
+    """
+    def signature():
+        sig = {}
+        for p in POLL_DIRS:
+            try:
+                sig[p] = os.stat(os.path.join(sysfs_root, p)).st_mtime_ns
+            except FileNotFoundError:
+                sig[p] = None
+        for root, p in POLL_FILES:
+            path = os.path.join(sysfs_root if root == "sysfs" else procfs_root, p)
+            sig[p] = hashlib.md5((read_value(path) or "").encode()).hexdigest()
+        return sig
+
+    last = signature()
+    while True:
+        time.sleep(interval)
+        current = signature()
+        for p in current:
+            if current[p] != last[p]:
+                yield p
+                break
+        last = current
+
+
+def watch(sysfs_root : str, procfs_root : str, source, emit : callable, pinning : dict = None, devices : list[str] = None):
+    """ Take a topology snapshot each time the source yields and emit the changes.
+
+    Args:
+        sysfs_root (str): sysfs mount point.
+        procfs_root (str): procfs mount point.
+        source (iterable): Event source, the watch stops when it is exhausted.
+        emit (callable): Called with each change event.
+        pinning (dict, optional): Pinning configuration to validate against the topology. Defaults to None.
+        devices (list[str], optional): Devices to validate against the topology, in addition to the ones of the pinning. Defaults to None.
+    """
+    topology = snapshot(sysfs_root, procfs_root)
+    devices = sorted(set((pinning_devices(pinning) if pinning else []) + (devices or [])))
+    pinning_status = {"missing_cpus" : [], "missing_devices" : []}
+
+    def validate():
+        nonlocal pinning_status
+        if (pinning is None) and (len(devices) == 0):
+            return
+        status = check_pinning(pinning, topology, devices)
+        if status != pinning_status:
+            valid = not any(status.values())
+            emit({"time" : time.time(), "type" : "pinning_valid" if valid else "pinning_invalid", **status})
+        pinning_status = status
+
+    validate()
+    for trigger in source:
+        new = snapshot(sysfs_root, procfs_root)
+        changes = diff(topology, new)
+        topology = new
+        for e in changes:
+            emit({"time" : time.time(), "trigger" : trigger, **e})
+        if changes:
+            validate()
+
+
+def main(args : argparse.Namespace):
+    pinning = None
+    if args.pinning:
+        with open(args.pinning, "r") as f:
+            pinning = json.load(f)
+    devices = list(args.devices or [])
+    if args.partition:
+        with open(args.partition, "r") as f:
+            devices += partition_devices(json.load(f))
+
+    if args.poll:
+        source = poll_source(args.sysfs_root, args.procfs_root, args.interval)
+    else:
+        try:
+            source = uevent_source(open_uevent_socket(), args.interval)
+        except (OSError, AttributeError) as err:
+            print(f"uevents are not available ({err}), polling every {args.interval} s instead", file = sys.stderr)
+            source = poll_source(args.sysfs_root, args.procfs_root, args.interval)
+
+    def emit(event : dict):
+        sys.stdout.write(json.dumps(event) + "\n")
+        sys.stdout.flush()
+
+    watch(args.sysfs_root, args.procfs_root, source, emit, pinning, devices)
+    return
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser("Watch the host topology and report changes as json events.")
+    parser.add_argument("-p", "--pinning", type = str, help = "pinning file to validate against the topology, the \"device\" entries of a template are checked too.")
+    parser.add_argument("--partition", type = str, help = "partition.json file made by create_pinning_minimal.py, the session devices are checked.")
+    parser.add_argument("-d", "--devices", type = str, nargs = "+", help = "devices (PCI address or network interface) to check.")
+    parser.add_argument("--poll", action = "store_true", help = "poll the online cpus, sysfs device directories and /proc/mdstat instead of listening to uevents.")
+    parser.add_argument("-i", "--interval", type = float, default = 2, help = "polling interval in seconds.")
+    parser.add_argument("--sysfs_root", type = str, default = "/sys", help = "sysfs mount point.")
+    parser.add_argument("--procfs_root", type = str, default = "/proc", help = "procfs mount point.")
+
+    args = parser.parse_args()
+    main(args)